@@ -7,6 +7,9 @@
 #include <sstream>
 #include <algorithm>
 #include <cmath>
+#include <cstdlib>
+#include <cstring>
+#include <cstdint>
 
 struct GPSANSData {
 	// output data available from MNO file decoding 
@@ -21,6 +24,7 @@ struct DetIDMap {
 	int id;
 	double scaling;
 	double x, z;
+	bool found = false;
 };
 
 // Read DetIDmap.csv into a vector of DetIDMap structs
@@ -53,6 +57,117 @@ std::vector<DetIDMap> load_DetIDMap_data(std::string& detIDmap) {
 	return detIDMapData;
 } 
 
+// Dense lookup table indexed by detector ID, so each event is a single array access
+std::vector<DetIDMap> build_DetIDLookup(const std::vector<DetIDMap>& detIDMapData, int minSize) {
+	std::vector<DetIDMap> lookup(minSize);
+	for (const DetIDMap& detIDMap : detIDMapData) {
+		if (detIDMap.id < 0) {
+			throw std::runtime_error("Negative detector ID in DetIDmap: " + std::to_string(detIDMap.id));
+		}
+		if (detIDMap.id >= static_cast<int>(lookup.size())) {
+			lookup.resize(detIDMap.id + 1);
+		}
+		lookup[detIDMap.id] = detIDMap;
+		lookup[detIDMap.id].found = true;
+	}
+	return lookup;
+}
+
+// Parse "GPS time, relative time, detector ID, value" with strtod/strtol
+// instead of a stringstream per line
+bool parse_event(const std::string& line, GPSANSData& data) {
+	const char* p = std::strchr(line.c_str(), ',');
+	if (p == nullptr) return false;
+	data.gps_time.assign(line.c_str(), p);
+
+	char* end;
+	data.time = std::strtod(p + 1, &end);
+	if (end == p + 1 || (p = std::strchr(end, ',')) == nullptr) return false;
+	data.id = std::strtol(p + 1, &end, 10);
+	if (end == p + 1 || (p = std::strchr(end, ',')) == nullptr) return false;
+	data.value = std::strtol(p + 1, &end, 10);
+	return end != p + 1;
+}
+
+// CRC-32 of a buffer, as stored in zip archives
+uint32_t crc32(const std::string& bytes) {
+	static uint32_t table[256] = {0};
+	if (table[1] == 0) {
+		for (uint32_t i = 0; i < 256; ++i) {
+			uint32_t c = i;
+			for (int k = 0; k < 8; ++k) {
+				c = (c & 1) ? 0xEDB88320u ^ (c >> 1) : c >> 1;
+			}
+			table[i] = c;
+		}
+	}
+	uint32_t crc = 0xFFFFFFFFu;
+	for (unsigned char b : bytes) {
+		crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8);
+	}
+	return crc ^ 0xFFFFFFFFu;
+}
+
+// Append an unsigned integer of the given number of bytes, little-endian
+void put_le(std::string& out, uint64_t value, int bytes) {
+	for (int i = 0; i < bytes; ++i) {
+		out += static_cast<char>((value >> (8*i)) & 0xFF);
+	}
+}
+
+// .npy file of an array with NumPy dtype descr, dimensions shape and raw data body
+std::string npy_array(const std::string& descr, const std::vector<size_t>& shape, const std::string& body) {
+	std::string dict = "{'descr': '" + descr + "', 'fortran_order': False, 'shape': (";
+	for (size_t n : shape) {
+		dict += std::to_string(n) + ",";
+	}
+	dict += "), }";
+	// pad with spaces so the data starts at a multiple of 64 bytes
+	dict.append((64 - (10 + dict.size() + 1) % 64) % 64, ' ');
+	dict += '\n';
+
+	std::string out("\x93NUMPY\x01\x00", 8);
+	put_le(out, dict.size(), 2);
+	return out + dict + body;
+}
+
+// Write named .npy members to an uncompressed (stored) zip archive, the .npz
+// format read by numpy.load
+void write_npz(const std::string& filename, const std::vector<std::pair<std::string, std::string>>& members) {
+	std::string out, central;
+	for (const auto& member : members) {
+		const std::string& name = member.first;
+		const std::string& body = member.second;
+		uint32_t crc = crc32(body);
+		size_t offset = out.size();
+
+		// local file header: version 2.0, no flags, stored, dated 1980-01-01
+		put_le(out, 0x04034b50, 4); put_le(out, 20, 2); put_le(out, 0, 2); put_le(out, 0, 2);
+		put_le(out, 0x00210000, 4); put_le(out, crc, 4); put_le(out, body.size(), 4); put_le(out, body.size(), 4);
+		put_le(out, name.size(), 2); put_le(out, 0, 2);
+		out += name + body;
+
+		// central directory entry
+		put_le(central, 0x02014b50, 4); put_le(central, 20, 2); put_le(central, 20, 2); put_le(central, 0, 2);
+		put_le(central, 0, 2); put_le(central, 0x00210000, 4); put_le(central, crc, 4); put_le(central, body.size(), 4);
+		put_le(central, body.size(), 4); put_le(central, name.size(), 2); put_le(central, 0, 2); put_le(central, 0, 2);
+		put_le(central, 0, 2); put_le(central, 0, 2); put_le(central, 0, 4); put_le(central, offset, 4);
+		central += name;
+	}
+
+	// end of central directory
+	std::string end;
+	put_le(end, 0x06054b50, 4); put_le(end, 0, 2); put_le(end, 0, 2);
+	put_le(end, members.size(), 2); put_le(end, members.size(), 2);
+	put_le(end, central.size(), 4); put_le(end, out.size(), 4); put_le(end, 0, 2);
+
+	std::ofstream npzFile(filename, std::ios::binary);
+	if (!npzFile.is_open()) {
+		throw std::runtime_error("Error opening output file!");
+	}
+	npzFile << out << central << end;
+}
+
 int main(int argc, char** argv) {
 	// Parse arguments
 	if (argc != 5) {
@@ -83,9 +198,9 @@ int main(int argc, char** argv) {
 	std::vector<std::vector<int>> N_histogram(numBinsY, std::vector<int>(numBinsX, 0));
 
 	// Load mapping from DetIDmap.csv
-	std::vector<DetIDMap> detIDMapData;
+	std::vector<DetIDMap> detIDLookup;
 	try {
-		detIDMapData = load_DetIDMap_data(detIDmap); 
+		detIDLookup = build_DetIDLookup(load_DetIDMap_data(detIDmap), 196); 
 	} catch (const std::exception& e) {
 		std::cerr << e.what() << std::endl;
 		return 1;
@@ -129,28 +244,25 @@ int main(int argc, char** argv) {
 	}
 
 	// Read neutron data from the input file
+	long missingEvents = 0;
+	long outOfRangeEvents = 0;
 	while (std::getline(inputFile, line)) {
 		// Skip lines starting with '#'
 		if (line.empty() || line[0] == '#') {
 			continue;
 		}
 
-		std::istringstream iss(line);
-
 		// Read line to "GPS time, relative time, detector ID, value"
-		// Use comma as the delimiter
-		char comma;
-		if (!(iss >> data.gps_time >> comma >> data.time >> comma >> data.id >> comma >> data.value)) {
+		if (!parse_event(line, data)) {
 			std::cerr << "Error reading line: " << line << std::endl;
 			continue;
 		}
 
 		// If Detector ID is of first plane, give z=-, if of second plane, give z=+
 		// Lookup DetIDmap information based on data.id
-		auto it = std::find_if(detIDMapData.begin(), detIDMapData.end(),
-							   [data](const DetIDMap &detIDMap) { return detIDMap.id == data.id; });
+		const DetIDMap* it = (data.id >= 0 && data.id <= 195) ? &detIDLookup[data.id] : nullptr;
 
-		if (it != detIDMapData.end() && data.id <= 195) {
+		if (it != nullptr && it->found) {
 			// Set z position based on DetIDmap 
 			data.z = it->z; 
 
@@ -161,10 +273,16 @@ int main(int argc, char** argv) {
 			data.y = data.value * it->scaling;
 
 			// Determine x and y bin for detector image
-			int xBin = static_cast<int>((data.x - xmin) / xbinSize);
-			int yBin = static_cast<int>((data.y - ymin) / ybinSize);
+			int xBin = static_cast<int>(std::floor((data.x - xmin) / xbinSize));
+			int yBin = static_cast<int>(std::floor((data.y - ymin) / ybinSize));
 			//int yBin = data.value;
 
+			// Ignore events outside the detector image
+			if (xBin < 0 || xBin >= numBinsX || yBin < 0 || yBin >= numBinsY) {
+				outOfRangeEvents++;
+				continue;
+			}
+
 			// Increment N counter
 			N_histogram[yBin][xBin] ++;
 
@@ -172,7 +290,7 @@ int main(int argc, char** argv) {
 			//std::cerr << "Warning: Ignoring event with ID " << data.id << " as it is greater than 195." << std::endl;
 
 		} else {
-			std::cerr << "Error: DetIDmap information not found for ID " << data.id << std::endl;
+			missingEvents++;
 			continue;
 
 		}
@@ -181,6 +299,65 @@ int main(int argc, char** argv) {
 
 	inputFile.close();
 
+	if (missingEvents > 0) {
+		std::cerr << "Error: DetIDmap information not found for " << missingEvents << " events" << std::endl;
+	}
+	if (outOfRangeEvents > 0) {
+		std::cerr << "Warning: Ignoring " << outOfRangeEvents << " events outside the detector image" << std::endl;
+	}
+
+
+	// McStas header lines, shared by the text and .npz output
+	std::ostringstream xylimits;
+	xylimits << "xylimits: " << 100*xmin << " " << 100*xmax << " " << 100*ymin << " " << 100*ymax;
+	std::vector<std::string> header = {
+		"Format: GP-SANS Data Summary with McStas format",
+		"Instrument: CG-2",
+		"type: array_2d(" + std::to_string(numBinsX) + ", " + std::to_string(numBinsY) + ")",
+		"component: Histogram",
+		"position: 0 0 ?",
+		"title: " + output_title,
+		"xvar: X",
+		"yvar: Y",
+		"xlabel: X position [cm]",
+		"ylabel: Y position [cm]",
+		"zvar: N",
+		xylimits.str()};
+
+	// Binary output: header lines and the I, I_err and N blocks stacked
+	// row-wise, as read by mcstasHelper.loadMcStasMonitor
+	std::string outName(argv[3]);
+	if (outName.size() >= 4 && outName.compare(outName.size() - 4, 4, ".npz") == 0) {
+		size_t width = 1;
+		for (const std::string& headerLine : header) {
+			width = std::max(width, headerLine.size());
+		}
+		std::string headerBody;
+		for (const std::string& headerLine : header) {
+			headerBody += headerLine + std::string(width - headerLine.size(), '\0');
+		}
+
+		std::vector<double> data;
+		data.reserve(3 * numBinsY * numBinsX);
+		for (int block = 0; block < 3; ++block) {
+			for (int yBin = 0; yBin < numBinsY; ++yBin) {
+				for (int xBin = 0; xBin < numBinsX; ++xBin) {
+					double n = N_histogram[yBin][xBin];
+					data.push_back(block == 0 ? n/ duration : block == 1 ? pow(n,0.5)/ duration : n);
+				}
+			}
+		}
+		std::string dataBody(reinterpret_cast<const char*>(data.data()), data.size() * sizeof(double));
+
+		try {
+			write_npz(outName, {{"header.npy", npy_array("|S" + std::to_string(width), {header.size()}, headerBody)},
+								{"data.npy", npy_array("<f8", {static_cast<size_t>(3 * numBinsY), static_cast<size_t>(numBinsX)}, dataBody)}});
+		} catch (const std::exception& e) {
+			std::cerr << e.what() << std::endl;
+			return 1;
+		}
+		return 0;
+	}
 
 	// Output data to file
 	std::ofstream outFile(argv[3]);
@@ -190,18 +367,9 @@ int main(int argc, char** argv) {
 		return 1;
 	}
 
-	outFile << "# Format: GP-SANS Data Summary with McStas format" << std::endl;
-	outFile << "# Instrument: CG-2" << std::endl;
-	outFile << "# type: array_2d(" << numBinsX << ", " << numBinsY << ")" << std::endl;
-	outFile << "# component: Histogram" << std::endl;
-	outFile << "# position: 0 0 ?" << std::endl;
-	outFile << "# title: " << output_title << std::endl;
-	outFile << "# xvar: X" << std::endl;
-	outFile << "# yvar: Y" << std::endl;
-	outFile << "# xlabel: X position [cm]" << std::endl;
-	outFile << "# ylabel: Y position [cm]" << std::endl;
-	outFile << "# zvar: N" << std::endl;
-	outFile << "# xylimits: " << 100*xmin << " " << 100*xmax << " " << 100*ymin << " " << 100*ymax << std::endl;
+	for (const std::string& headerLine : header) {
+		outFile << "# " << headerLine << std::endl;
+	}
 
 	// output dummy I array
 	outFile << "# Data [] I:" << std::endl;
@@ -1,142 +1,198 @@
 import numpy as np
-from scipy.special import gammaln
 import h5py
-import string
 import argparse
-
-parser = argparse.ArgumentParser()
-parser.add_argument("inFile", help="Input file")
-parser.add_argument('--rebin', nargs=1, type=float, metavar=('newSize'),
-					help='Resized array length: newSize')
-parser.add_argument('--outlier', nargs=1, type=float, metavar=('n'),
-					help='if true, then eliminate datapoints greater than n sigma away from the mean')
-parser.add_argument('--noshow', action='store_true', help='if true then only show value, dont display plot')
-
-args = parser.parse_args()
-inFile = args.inFile
-
-# get data from h5 file
-file = h5py.File(inFile, "r")
-group = file["entry"]
-
-# extract relevant data from input file
-event_time_zero = np.array(group["monitor2/event_time_zero"]) # seconds
-event_time_offset = np.array(group["monitor2/event_time_offset"]) # microseconds
-event_index = np.array(group["monitor2/event_index"])
-
-counts_per_bin = np.diff(event_index) 
-counts_per_bin_err = np.sqrt(counts_per_bin)
-time_per_bin = np.diff(event_time_zero)
-
-# rebin histogram if necessary to increase statistics
-if args.rebin:
-	def rebin_histogram(hist, new_size):
-		old_size = hist.size
-	
-		if new_size >= old_size:
-			raise ValueError("The new size should be smaller than the old size.")
-	
-		if old_size % new_size != 0:
-			rem = old_size % new_size
-			print("! New size is not a factor of old size, cutting out last ", rem, " entries")
-			hist = hist[:-rem]
-	
-		factor = old_size // new_size
-	
-		# Reshape the histogram array to a 2D array
-		hist_2d = hist.reshape((new_size, factor))
-	
-		# Sum the values in each bin of the new histogram
-		rebinned_hist = np.sum(hist_2d, axis=1)
-	
-		return rebinned_hist
-
-	# rebin counts_per_bin, time_per_bin
-	newSize = int(args.rebin[0])
-	rebinned_counts = rebin_histogram(counts_per_bin, newSize) # sum col-wise
-	rebinned_time = rebin_histogram(event_time_zero[:-1], newSize)/ (event_time_zero[:-1].size // newSize) # average col-wise
-	rebinned_counts_err = np.sqrt(rebin_histogram(np.square(counts_per_bin_err), newSize)) # sqrt of sum col-wise of squared values
+from rebinHelper import rebin_array
+
+# Read monitor2 pulse times and event indices in slices aligned to the HDF5
+# chunks of event_index (whole chunks, at least chunk_rows rows), so neither
+# dataset is held in memory and event_time_offset is never touched. Each
+# slice starts with the last pulse of the previous one, so np.diff of a slice
+# gives the per-pulse counts and bin widths without gaps
+def pulse_slices(group, chunk_rows=1<<20):
+	event_time_zero = group["monitor2/event_time_zero"] # seconds
+	event_index = group["monitor2/event_index"]
+	n = event_index.shape[0]
+	chunk = event_index.chunks[0] if event_index.chunks else 1
+	step = max(chunk, chunk_rows // chunk * chunk)
+
+	last = None
+	for start in range(0, n, step):
+		t = event_time_zero[start:start+step]
+		index = event_index[start:start+step]
+		if last is not None:
+			t = np.concatenate([last[0], t])
+			index = np.concatenate([last[1], index])
+		last = (t[-1:], index[-1:])
+		if len(t) > 1:
+			yield t, index
+
+# Per-pulse count rates: yields (event_time, counts_per_second, counts_per_second_err, time_per_bin) slices
+def pulse_rates(group, chunk_rows=1<<20):
+	for t, index in pulse_slices(group, chunk_rows):
+		counts_per_bin = np.diff(index)
+		counts_per_bin_err = np.sqrt(counts_per_bin)
+		time_per_bin = np.diff(t)
+		yield t[:-1], counts_per_bin/ time_per_bin, counts_per_bin_err/ time_per_bin, time_per_bin
+
+# Count rates after summing the pulses into new_size bins (trailing pulses that
+# do not fill a bin are dropped). Groups are accumulated slice by slice and
+# the (small) rebinned series is returned as a single slice
+def rebinned_rates(group, new_size, chunk_rows=1<<20):
+	old_size = group["monitor2/event_index"].shape[0] - 1
+	if new_size >= old_size:
+		raise ValueError("The new size should be smaller than the old size.")
+	if old_size % new_size != 0:
+		print("! New size is not a factor of old size, cutting out last ", old_size % new_size, " entries")
+	factor = old_size // new_size
+
+	rebinned_counts = np.zeros(new_size)
+	rebinned_err_sq = np.zeros(new_size)
+	rebinned_time = np.zeros(new_size)
+	done = 0
+	carry_counts, carry_time = np.zeros(0, dtype=np.uint64), np.zeros(0)
+	for t, index in pulse_slices(group, chunk_rows):
+		counts_per_bin = np.concatenate([carry_counts, np.diff(index)])
+		pulse_time = np.concatenate([carry_time, t[:-1]])
+
+		# only whole groups of factor pulses, the rest is carried to the next slice
+		groups = min(len(counts_per_bin) // factor, new_size - done)
+		used = groups * factor
+		rebinned_counts[done:done+groups] = rebin_array(counts_per_bin[:used], factor) # sum col-wise
+		rebinned_err_sq[done:done+groups] = rebin_array(np.square(np.sqrt(counts_per_bin[:used])), factor) # sum col-wise of squared values
+		rebinned_time[done:done+groups] = rebin_array(pulse_time[:used], factor)/ factor # average col-wise
+		carry_counts, carry_time = counts_per_bin[used:], pulse_time[used:]
+		done += groups
 
 	# find count rate
-	event_time = rebinned_time[:-1]
 	time_per_bin = np.diff(rebinned_time)
-	counts_per_second = rebinned_counts[:-1]/ time_per_bin
-	counts_per_second_err = rebinned_counts_err[:-1]/ time_per_bin
-else:
-	# find count rate
-	event_time = event_time_zero[:-1]
-	time_per_bin = time_per_bin
-	counts_per_second = counts_per_bin/ time_per_bin
-	counts_per_second_err = counts_per_bin_err/ event_time_zero[:-1]
-
-# weighted mean and standard error
-def mean_with_error(points, errors):
-	weighted_sum = np.sum(points / (errors ** 2))
-	sum_of_weights = np.sum(1 / (errors ** 2))
-	mean = weighted_sum / sum_of_weights
-	error = np.sqrt(1 / sum_of_weights)
-	return mean, error
-
-# Calculate deviance and reduced deviance for Poisson data fit
-def calculate_poisson_deviance(counts_per_second, mean):
-	observed_log_likelihood = counts_per_second * np.log(counts_per_second) - counts_per_second - gammaln(counts_per_second + 1)
-	expected_log_likelihood = counts_per_second * np.log(mean) - mean - gammaln(counts_per_second + 1)
-	deviance = 2 * np.sum(observed_log_likelihood - expected_log_likelihood)
-	return deviance
-
-#k = np.mean(counts_per_second)
-#k_err = np.sqrt(np.sum(np.square(counts_per_second_err)))
-k, k_err = mean_with_error(counts_per_second, counts_per_second_err)
-deviance = calculate_poisson_deviance(counts_per_second, k)
-deviance_ndof = deviance/ (counts_per_second.size - 1)
-
-if (args.outlier==1):
-	print('without removing outliers:')
-print("{:.2e}".format(k), "±", "{:.2e}".format(k_err)," counts/ second")
-print("deviance/ ndof = ", deviance_ndof)
-print('average bin width:',np.average(time_per_bin),'s')
-
-# if --outlier == true, then eliminate datapoints that lie > n sigma away from the mean
-if (args.outlier):
-	n = int(args.outlier[0])
-	def eliminate_outliers(array, errors, time, n):
-		mean = np.mean(array)
-		std = np.std(array)
-		threshold = n * std
-	
-		filtered_array = array[abs(array - mean) <= threshold]
-		filtered_errors = errors[abs(array - mean) <= threshold]
-		filtered_time = time[abs(array - mean) <= threshold]
-	
-		return filtered_array, filtered_errors, filtered_time
-
-	counts_per_second, counts_per_second_err, event_time = eliminate_outliers(counts_per_second, counts_per_second_err, event_time, n)
-
-	#k = np.mean(counts_per_second)
-	#k_err = np.sqrt(np.sum(np.square(counts_per_second_err)))
-	k, k_err = mean_with_error(counts_per_second, counts_per_second_err)
-	deviance = calculate_poisson_deviance(counts_per_second, k)
-	deviance_ndof = deviance/ (counts_per_second.size - 1)
-	
-	print('with outliers removed :')
-	print("{:.2e}".format(k), "±", "{:.2e}".format(k_err)," counts/ second")
-	print("deviance/ ndof = ", deviance_ndof)
-
-if (args.noshow==0):
-	import matplotlib.pyplot as plt
-	plt.errorbar(event_time, counts_per_second, yerr=counts_per_second_err, 
-			fmt=' ', capsize=2, label='counts per second')
-	plt.plot(event_time, np.zeros(event_time.size) + k, 
-			linestyle='--', label='mean = '+"{:.2e}".format(k))
-
-	plt.fill_between(event_time, np.zeros(event_time.size)+k-(k_err/2), np.zeros(event_time.size)+k+(k_err/2),
-			color='gray', alpha=0.9, label='mean error = '+"{:.2e}".format(k_err))
-
-	plt.xlabel('time [s]')
-	plt.ylabel('count rate [1/s]')
-	plt.legend()
-	plt.grid()
-	plt.title(group["title"][0].decode("UTF-8"))
-
-	plt.show()
-
+	yield rebinned_time[:-1], rebinned_counts[:-1]/ time_per_bin, np.sqrt(rebinned_err_sq)[:-1]/ time_per_bin, time_per_bin
+
+# Accumulate, over slices of rates, the sums for the weighted mean and its
+# error, the Poisson deviance, the mean bin width and the mean and standard
+# deviation of the rates (chunks merged as in Chan et al.)
+def rate_sums(slices):
+	sums = dict(n=0, weights=0., weighted=0., log_likelihood=0., rate=0., width=0., mean=0., m2=0.)
+	for event_time, counts_per_second, counts_per_second_err, time_per_bin in slices:
+		n = counts_per_second.size
+		if n == 0:
+			continue
+		weights = 1 / (counts_per_second_err ** 2)
+		sums['weights'] += np.sum(weights)
+		sums['weighted'] += np.sum(counts_per_second * weights)
+		# Poisson log likelihood terms that do not depend on the mean, gammaln cancels in the deviance
+		sums['log_likelihood'] += np.sum(counts_per_second * np.log(counts_per_second) - counts_per_second)
+		sums['rate'] += np.sum(counts_per_second)
+		sums['width'] += np.sum(time_per_bin)
+
+		mean = np.mean(counts_per_second)
+		m2 = np.sum(np.square(counts_per_second - mean))
+		delta = mean - sums['mean']
+		total = sums['n'] + n
+		sums['mean'] += delta * n / total
+		sums['m2'] += m2 + delta**2 * sums['n'] * n / total
+		sums['n'] = total
+	return sums
+
+# eliminate datapoints that lie > threshold away from the mean, slice by slice
+def select_rates(slices, mean, threshold):
+	for event_time, counts_per_second, counts_per_second_err, time_per_bin in slices:
+		keep = abs(counts_per_second - mean) <= threshold
+		yield event_time[keep], counts_per_second[keep], counts_per_second_err[keep], time_per_bin[keep]
+
+# weighted mean and standard error, and deviance/ ndof of a Poisson fit with that mean
+def rate_statistics(sums):
+	k = sums['weighted'] / sums['weights']
+	k_err = np.sqrt(1 / sums['weights'])
+	deviance = 2 * (sums['log_likelihood'] - sums['rate'] * np.log(k) + sums['n'] * k)
+	return k, k_err, deviance/ (sums['n'] - 1)
+
+# Weighted mean count rate of monitor2 in a NeXus event file, with its error
+# and the reduced Poisson deviance. rebin sums the pulses into that many bins,
+# outlier drops rates more than outlier sigma from the mean. The file is
+# streamed in chunk-aligned slices, and the rate time series is only kept if
+# series is true. Returns a dict with k, k_err, deviance_ndof, the average
+# bin width, the number of rate points used, the run title and
+# (event_time, counts_per_second, counts_per_second_err) with series
+def beam_rate(inFile, rebin=None, outlier=None, series=True, chunk_rows=1<<20):
+	# get data from h5 file
+	with h5py.File(inFile, "r") as file:
+		group = file["entry"]
+		title = group["title"][0].decode("UTF-8")
+
+		if rebin:
+			# the rebinned series is small, read it once
+			rebinned = list(rebinned_rates(group, int(rebin), chunk_rows))
+			slices = lambda: iter(rebinned)
+		else:
+			slices = lambda: pulse_rates(group, chunk_rows)
+
+		sums = rate_sums(slices())
+		k, k_err, deviance_ndof = rate_statistics(sums)
+		result = {'k': k, 'k_err': k_err, 'deviance_ndof': deviance_ndof,
+				  'bin_width': sums['width'] / sums['n'], 'points': sums['n'], 'title': title}
+
+		# if outlier is given, then eliminate datapoints that lie > n sigma away from the mean
+		selected = slices
+		if outlier:
+			mean = sums['mean']
+			threshold = int(outlier) * np.sqrt(sums['m2'] / sums['n'])
+			selected = lambda: select_rates(slices(), mean, threshold)
+
+			result.update(k_all=k, k_err_all=k_err, deviance_ndof_all=deviance_ndof)
+			selected_sums = rate_sums(selected())
+			k, k_err, deviance_ndof = rate_statistics(selected_sums)
+			result.update(k=k, k_err=k_err, deviance_ndof=deviance_ndof, points=selected_sums['n'])
+
+		if series:
+			parts = list(zip(*selected()))
+			for key, values in zip(('event_time', 'counts_per_second', 'counts_per_second_err'), parts):
+				result[key] = np.concatenate(values)
+	return result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("inFile", help="Input file")
+	parser.add_argument('--rebin', nargs=1, type=float, metavar=('newSize'),
+						help='Resized array length: newSize')
+	parser.add_argument('--outlier', nargs=1, type=float, metavar=('n'),
+						help='if true, then eliminate datapoints greater than n sigma away from the mean')
+	parser.add_argument('--noshow', action='store_true', help='if true then only show value, dont display plot')
+
+	args = parser.parse_args()
+	inFile = args.inFile
+
+	result = beam_rate(inFile, rebin=args.rebin[0] if args.rebin else None,
+					   outlier=args.outlier[0] if args.outlier else None, series=(args.noshow==0))
+
+	if args.outlier:
+		print('without removing outliers:')
+		print("{:.2e}".format(result['k_all']), "±", "{:.2e}".format(result['k_err_all'])," counts/ second")
+		print("deviance/ ndof = ", result['deviance_ndof_all'])
+	else:
+		print("{:.2e}".format(result['k']), "±", "{:.2e}".format(result['k_err'])," counts/ second")
+		print("deviance/ ndof = ", result['deviance_ndof'])
+	print('average bin width:',result['bin_width'],'s')
+
+	if args.outlier:
+		print('with outliers removed :')
+		print("{:.2e}".format(result['k']), "±", "{:.2e}".format(result['k_err'])," counts/ second")
+		print("deviance/ ndof = ", result['deviance_ndof'])
+
+	if (args.noshow==0):
+		import matplotlib.pyplot as plt
+		event_time, k, k_err = result['event_time'], result['k'], result['k_err']
+		plt.errorbar(event_time, result['counts_per_second'], yerr=result['counts_per_second_err'],
+				fmt=' ', capsize=2, label='counts per second')
+		plt.plot(event_time, np.zeros(event_time.size) + k,
+				linestyle='--', label='mean = '+"{:.2e}".format(k))
+
+		plt.fill_between(event_time, np.zeros(event_time.size)+k-(k_err/2), np.zeros(event_time.size)+k+(k_err/2),
+				color='gray', alpha=0.9, label='mean error = '+"{:.2e}".format(k_err))
+
+		plt.xlabel('time [s]')
+		plt.ylabel('count rate [1/s]')
+		plt.legend()
+		plt.grid()
+		plt.title(result['title'])
+
+		plt.show()
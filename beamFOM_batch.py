@@ -0,0 +1,162 @@
+#!/bin/python3
+# Beam stability of many NeXus runs in one process
+#
+# Every run is reduced with beamFOM.beam_rate (weighted mean rate, Poisson
+# deviance/ndof and, with --outlier, the outlier-filtered rate) by a pool of
+# worker processes. Results are written as they arrive, so reading the next
+# files overlaps with reducing and writing the previous ones. A run that
+# cannot be reduced gets a row with its error and NaN values instead of
+# stopping the batch. The output is one summary table (CSV, or Parquet with
+# pandas, which is written at the end) and optionally the per-run
+# rate time series in a columnar file: an HDF5 file with one group of
+# event_time, counts_per_second and counts_per_second_err per run, or a long
+# Parquet table with a filename column.
+
+import os
+import sys
+import csv
+import glob
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from beamFOM import beam_rate
+
+SERIES = ['event_time', 'counts_per_second', 'counts_per_second_err']
+
+def summary_columns(outlier):
+	columns = ['filename', 'title', 'k', 'k_err', 'deviance_ndof', 'bin_width', 'points']
+	if outlier:
+		columns += ['k_all', 'k_err_all', 'deviance_ndof_all']
+	return columns + ['error']
+
+# Worker: reduce one run, returning plain values for the writers. Errors are
+# returned in 'error' with NaN values, so one bad file does not stop the batch
+def reduce_run(filename, rebin, outlier, series):
+	try:
+		# keep beamFOM's messages out of a summary table written to stdout
+		with contextlib.redirect_stdout(sys.stderr):
+			result = beam_rate(filename, rebin=rebin, outlier=outlier, series=series)
+	except Exception as e:
+		result = {key: float('nan') for key in summary_columns(True)}
+		result.update(title='', error=f"{type(e).__name__}: {e}")
+	else:
+		result['error'] = ''
+	result['filename'] = filename
+	return result
+
+def beam_rate_batch(filenames, rebin=None, outlier=None, series=False, processes=None):
+	with ProcessPoolExecutor(processes) as pool:
+		yield from pool.map(reduce_run, filenames, [rebin]*len(filenames), [outlier]*len(filenames),
+							[series]*len(filenames))
+
+# Time series writers, one record per run
+class SeriesHDF5:
+	def __init__(self, outFile):
+		import h5py
+		self.file = h5py.File(outFile, 'w')
+
+	def write(self, result):
+		name = os.path.splitext(os.path.basename(result['filename']))[0]
+		while name in self.file:
+			name += '_'
+		group = self.file.create_group(name)
+		for key in SERIES:
+			group.create_dataset(key, data=result[key], chunks=True, compression='gzip', shuffle=True)
+		group.attrs['filename'] = os.path.abspath(result['filename'])
+		group.attrs['title'] = result['title']
+
+	def close(self):
+		self.file.close()
+
+class SeriesParquet:
+	def __init__(self, outFile):
+		self.outFile = outFile
+		self.frames = []
+
+	def write(self, result):
+		import pandas as pd
+		frame = pd.DataFrame({key: result[key] for key in SERIES})
+		frame.insert(0, 'filename', result['filename'])
+		self.frames.append(frame)
+
+	def close(self):
+		import pandas as pd
+		if self.frames:
+			frame = pd.concat(self.frames, ignore_index=True)
+		else:
+			frame = pd.DataFrame(columns=['filename'] + SERIES)
+		frame.to_parquet(self.outFile, index=False)
+
+# Summary table writers, one row per run. CSV rows are flushed as they arrive
+class SummaryCSV:
+	def __init__(self, outFile, columns):
+		self.file = open(outFile, 'w', newline='') if outFile else sys.stdout
+		self.writer = csv.writer(self.file)
+		self.writer.writerow(columns)
+
+	def write(self, row):
+		self.writer.writerow(row)
+		self.file.flush()
+
+	def close(self):
+		if self.file is not sys.stdout:
+			self.file.close()
+
+class SummaryParquet:
+	def __init__(self, outFile, columns):
+		self.outFile = outFile
+		self.columns = columns
+		self.rows = []
+
+	def write(self, row):
+		self.rows.append(row)
+
+	def close(self):
+		import pandas as pd
+		pd.DataFrame(self.rows, columns=self.columns).to_parquet(self.outFile, index=False)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Beam stability summary for many NeXus runs.')
+	parser.add_argument('files', nargs='+', help='.nxs.h5 files or glob patterns (quote them to expand here)')
+	parser.add_argument('--rebin', type=int, metavar='newSize', help='Resized array length: newSize')
+	parser.add_argument('--outlier', type=float, metavar='n',
+						help='eliminate datapoints greater than n sigma away from the mean')
+	parser.add_argument('--out', type=str, help='summary table, .csv or .parquet (default: CSV to stdout)')
+	parser.add_argument('--series', type=str, metavar='outFile',
+						help='also write the per-run rate time series, .h5 or .parquet')
+	parser.add_argument('--processes', type=int, help='number of worker processes (default: all cores)')
+	args = parser.parse_args()
+
+	filenames = []
+	for pattern in args.files:
+		matches = sorted(glob.glob(pattern, recursive=True))
+		filenames.extend(matches if matches else [pattern])
+	filenames = list(dict.fromkeys(filenames))
+
+	series = None
+	if args.series:
+		series = SeriesParquet(args.series) if args.series.endswith('.parquet') else SeriesHDF5(args.series)
+
+	columns = summary_columns(args.outlier)
+	if args.out and args.out.endswith('.parquet'):
+		summary = SummaryParquet(args.out, columns)
+	else:
+		summary = SummaryCSV(args.out, columns)
+	failed = 0
+	try:
+		for result in beam_rate_batch(filenames, args.rebin, args.outlier, series is not None, args.processes):
+			summary.write([result[key] for key in columns])
+			if result['error']:
+				failed += 1
+				print(f"{result['filename']}: {result['error']}", file=sys.stderr)
+				continue
+			if series is not None:
+				series.write(result)
+			print(f"{result['filename']}: {result['k']:.2e} ± {result['k_err']:.2e} counts/ second", file=sys.stderr)
+	finally:
+		summary.close()
+		if series is not None:
+			series.close()
+
+	if failed:
+		sys.exit(1)
@@ -0,0 +1,99 @@
+# benchmark mcstasHelper.extractMcStasData against the previous genfromtxt parser
+# usage: python3 benchmarks/bench_extract.py [file.dat ...]
+# with no files given, a synthetic 1000x1000 PSD monitor is written to a temp directory
+# the parsers are timed with the monitor cache bypassed, cached loads on a separate line
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import mcstasHelper as mc
+
+# previous implementation: genfromtxt for the data, then a second pass for the header
+def extract_genfromtxt(filename):
+	data = np.genfromtxt(filename)
+	raw = []
+	with open(filename, 'r') as f:
+		while True:
+			r = f.readline()
+			if (r[0]=="#"): raw.append(r[2:-1])
+			else: break
+	dataHeader = {}
+	for i in raw:
+		t = i.split(": ")
+		try:
+			dataHeader[t[0]]=t[1]
+		except:
+			break
+	if dataHeader['type'][:8]=="array_2d":
+		s = np.shape(data)
+		return data[:s[0]//3], data[s[0]//3:s[0]//3*2], data[2*s[0]//3:], dataHeader, []
+	L, I, sigI, N = data[:,0], data[:,1], data[:,2], data[:,3]
+	return I, sigI, N, dataHeader, L
+
+# write a synthetic array_2d monitor in McStas text format
+def write_synthetic(filename, nx, ny):
+	rng = np.random.default_rng(0)
+	I = rng.exponential(1e4, (ny, nx))
+	blocks = [('Data', 'I', I), ('Errors', 'I_err', np.sqrt(I)), ('Events', 'N', np.floor(I/10))]
+	with open(filename, 'w') as f:
+		f.write("# Format: McCode with text headers\n")
+		f.write(f"# type: array_2d({nx}, {ny})\n")
+		f.write("# component: Synthetic_PSD\n")
+		f.write("# position: 0 0 1\n")
+		f.write("# xlabel: X position [cm]\n")
+		f.write("# ylabel: Y position [cm]\n")
+		f.write("# xylimits: -10 10 -10 10\n")
+		f.write("# variables: I I_err N\n")
+		for label, var, block in blocks:
+			f.write(f"# {label} [Synthetic_PSD/psd.dat] {var}:\n")
+			np.savetxt(f, block, fmt='%g')
+
+def best_of(func, filename, repeat):
+	times = []
+	for i in range(repeat):
+		t0 = time.perf_counter()
+		result = func(filename)
+		times.append(time.perf_counter() - t0)
+	return min(times), result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark McStas monitor parsing')
+	parser.add_argument('filenames', nargs='*', help='McStas monitor files (default: synthetic 1000x1000 PSD)')
+	parser.add_argument('--repeat', type=int, default=3, help='number of timed repetitions')
+	args = parser.parse_args()
+
+	filenames = args.filenames
+	tmpdir = None
+	if not filenames:
+		tmpdir = tempfile.mkdtemp()
+		filenames = [os.path.join(tmpdir, 'psd_1000x1000.dat')]
+		write_synthetic(filenames[0], 1000, 1000)
+
+	try:
+		for filename in filenames:
+			t_old, old = best_of(extract_genfromtxt, filename, args.repeat)
+			t_new, new = best_of(lambda f: mc.extractMcStasData(f, cache=False), filename, args.repeat)
+			# first load fills the cache, the timed ones memory-map it
+			mc.extractMcStasData(filename, cache=True)
+			t_cached, cached = best_of(lambda f: mc.extractMcStasData(f, cache=True), filename, args.repeat)
+
+			# all must agree exactly
+			for result in (new, cached):
+				for a, b in zip(old[:3], result[:3]):
+					assert np.array_equal(a, b, equal_nan=True)
+				assert old[3] == result[3]
+
+			size = os.path.getsize(filename)/1e6
+			print(f"{os.path.basename(filename)} ({size:.1f} MB)")
+			print(f"  genfromtxt:  {t_old:.3f} s")
+			print(f"  single pass: {t_new:.3f} s  ({t_old/t_new:.1f}x)")
+			print(f"  cached load: {t_cached:.4f} s  ({t_old/t_cached:.1f}x)")
+	finally:
+		if tmpdir is not None:
+			shutil.rmtree(tmpdir, ignore_errors=True)
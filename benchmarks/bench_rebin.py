@@ -0,0 +1,57 @@
+# benchmark rebinHelper on 2048x2048 images against the previous rebinning code
+# usage: python3 benchmarks/bench_rebin.py [--size 2048] [--factor 4]
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rebinHelper as rb
+
+# previous mcstasHelper.rebin, applied along both axes of an image
+def rebin_loop(a, I):
+	def rebin_1d(a, I):
+		newa = np.zeros(len(a)//I)
+		for i in np.arange(I): newa+=a[i::I]
+		return newa
+	rows = np.array([rebin_1d(row, I) for row in a])
+	return np.array([rebin_1d(col, I) for col in rows.T]).T
+
+def best_of(func, repeat, *args):
+	times = []
+	for i in range(repeat):
+		t0 = time.perf_counter()
+		result = func(*args)
+		times.append(time.perf_counter() - t0)
+	return min(times), result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark 2d rebinning')
+	parser.add_argument('--size', type=int, default=2048, help='image size (size x size)')
+	parser.add_argument('--factor', type=int, default=4, help='integer rebin factor')
+	parser.add_argument('--repeat', type=int, default=3, help='number of timed repetitions')
+	args = parser.parse_args()
+
+	rng = np.random.default_rng(0)
+	n, f = args.size, args.factor
+	I = rng.exponential(1e4, (n, n))
+	sigI = np.sqrt(I)
+
+	t_loop, old = best_of(rebin_loop, 1, I, f)
+	t_new, new = best_of(rb.rebin_array, args.repeat, I, f)
+	t_err, err = best_of(rb.rebin_array, args.repeat, sigI, f, 'quadrature')
+	assert np.allclose(old, new)
+	print(f"integer rebin {n}x{n} by {f}")
+	print(f"  python loop (old mcstasHelper.rebin): {t_loop:.3f} s")
+	print(f"  rebin_array:                          {t_new:.4f} s  ({t_loop/t_new:.0f}x)")
+	print(f"  rebin_array, errors in quadrature:    {t_err:.4f} s")
+
+	# non-integer conservative regridding onto a (size/1.5)^2 grid
+	m = int(n / 1.5)
+	old_edges = [np.linspace(0, 1, n+1)] * 2
+	new_edges = [np.linspace(0, 1, m+1)] * 2
+	t_regrid, (J, sigJ) = best_of(rb.regrid, args.repeat, I, old_edges, new_edges, sigI)
+	assert np.isclose(J.sum(), I.sum())
+	print(f"conservative regrid {n}x{n} -> {m}x{m} with errors: {t_regrid:.3f} s")
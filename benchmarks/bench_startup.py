@@ -0,0 +1,69 @@
+# benchmark start-up time of the headless (--noshow) command line tools
+# usage: python3 benchmarks/bench_startup.py [--repeat 5] [--budget 0.2]
+# reports the `python -X importtime` cumulative import time of each module,
+# lists any plotting/TIFF/fitting packages it pulls in, and times complete
+# headless invocations on a small synthetic monitor
+
+import os
+import re
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_extract import write_synthetic
+
+MODULES = ['mcstasHelper', 'roiHelper', 'rebinHelper', 'mcstasStream', 'count', 'count_1d', 'find_ROI']
+HEAVY = ['matplotlib', 'PIL', 'tifffile', 'scipy', 'h5py', 'pandas']
+
+# cumulative import time in seconds and the set of top-level packages imported
+def import_time(module):
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import '+module],
+							cwd=root, capture_output=True, text=True, check=True)
+	total = None
+	packages = set()
+	for line in result.stderr.splitlines():
+		m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+		if m is None:
+			continue
+		packages.add(m.group(4).split('.')[0])
+		if m.group(4) == module:
+			total = int(m.group(2)) / 1e6
+	return total, packages
+
+def best_of(cmd, repeat):
+	times = []
+	for i in range(repeat):
+		t0 = time.perf_counter()
+		subprocess.run(cmd, cwd=root, capture_output=True, check=True)
+		times.append(time.perf_counter() - t0)
+	return min(times)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark start-up time of the headless tools')
+	parser.add_argument('--repeat', type=int, default=5, help='number of timed repetitions')
+	parser.add_argument('--budget', type=float, default=0.2, help='target wall time per invocation [s]')
+	args = parser.parse_args()
+
+	print("cumulative import time (python -X importtime)")
+	for module in MODULES:
+		total, packages = import_time(module)
+		heavy = sorted(p for p in HEAVY if p in packages)
+		print(f"  {module:14s} {total*1e3:7.1f} ms  {'imports '+', '.join(heavy) if heavy else ''}")
+
+	tmpdir = tempfile.mkdtemp()
+	filename = os.path.join(tmpdir, 'psd_100x100.dat')
+	write_synthetic(filename, 100, 100)
+
+	baseline = best_of([sys.executable, '-c', 'import numpy'], args.repeat)
+	print(f"\nwall time per invocation (best of {args.repeat}, python + numpy alone: {baseline*1e3:.0f} ms)")
+	commands = [['count.py', filename, '--square', '-3', '3', '-3', '3', '--noshow'],
+				['count.py', filename, '--circle', '0', '0', '4', '--noshow'],
+				['find_ROI.py', filename, '--rect', '1', '20', '1', '20', '--noshow']]
+	for cmd in commands:
+		t = best_of([sys.executable] + cmd, args.repeat)
+		status = 'ok' if t < args.budget else 'over budget'
+		print(f"  {' '.join(cmd[:1] + cmd[2:]):45s} {t*1e3:7.1f} ms  {status}")
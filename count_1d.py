@@ -1,58 +1,66 @@
 import mcstasHelper as mc
+from spectrumHelper import stack_stats, spectrum_stats_batch
 import numpy as np
 import re
 import json
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument("inFile", help="Input file")
-parser.add_argument('--noshow', action='store_true', help='if true then dont display graph, only show count')
-
-args = parser.parse_args()
-inFile = args.inFile
-
-I, sigI, N, dataHeader, L = mc.extractMcStasData(inFile) 
-component = dataHeader['component']
-#print(json.dumps(dataHeader, indent=4))
-print(inFile)
-
-if dataHeader['type'][:8]=="array_1d":
-	I, sigI, N, L = mc.mcstas2np(inFile)
-
-	# find fwhm
-	hm_I = np.max(I) / 2 
-	left_idx = np.argmin(np.abs(I[:np.argmax(I)] - hm_I))
-	right_idx = np.argmin(np.abs(I[np.argmax(I):] - hm_I)) + np.argmax(I)
-	print("fwhm: "+str(L[right_idx] - L[left_idx]))
-
-	# find max and corresponding x value
-	max_index = np.argmax(I)
-	print("wavelength: "+str(L[max_index])+", intensity: "+str(I[max_index]))
-
-	# find integrated intensity
-	print("sum within fwhm: "+str(np.sum(I[left_idx:right_idx]))+" ± "+str(np.sum(sigI[left_idx:right_idx])))
-
-	# find integrated intensity per angstrom [n/s/AA]
-	integrated_scaled_intensity = np.sum(I/ L) 
-	print(f"integrated intensity per angstrom: {integrated_scaled_intensity:.4e}")
-
-	unit = re.findall(r"\[(.*?)\]", dataHeader['xlabel'])
-	dx = (L[-1] - L[0]) / np.size(L) 
-
-	if (args.noshow==0):
-		import matplotlib.pyplot as plt
-
-		plt.errorbar(L, I, yerr=sigI, fmt='o', capsize=2)
-		plt.xlabel(dataHeader['xlabel'])
-		plt.ylabel('Intensity [n/s]/ '+"{:.2e}".format(dx)+' ['+unit[0]+']')
-		plt.title(component, pad=10)
-		plt.show()
-	
-		plt.plot(L, N)
-		plt.xlabel(dataHeader['xlabel'])
-		plt.ylabel('N/ '+"{:.2e}".format(dx)+' ['+unit[0]+']')
-		plt.title(component, pad=10)
-		plt.show()
-
-else:
-	print("Unknown Data Type.")
+# Peak, fwhm and integrated intensities of a 1d McStasMonitor (or monitor
+# file), see spectrumHelper.stack_stats. Use spectrum_stats_batch for many
+# spectra at once
+def spectrum_stats(mon):
+	if isinstance(mon, str):
+		mon = mc.loadMcStasMonitor(mon)
+	if mon.ndim != 1:
+		raise ValueError("Unknown Data Type.")
+	stats = stack_stats(mon.L, mon.I, mon.sigI)
+	return {key: values[0] for key, values in stats.items()}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("inFile", nargs='+', help="Input file(s)")
+	parser.add_argument('--noshow', action='store_true', help='if true then dont display graph, only show count')
+
+	args = parser.parse_args()
+
+	monitors = [mc.loadMcStasMonitor(inFile) for inFile in args.inFile]
+	spectra = [mon for mon in monitors if mon.ndim == 1]
+	batch = spectrum_stats_batch(spectra) if spectra else {}
+	position = {id(mon): i for i, mon in enumerate(spectra)}
+
+	for mon in monitors:
+		inFile = mon.filename
+		dataHeader = mon.header
+		component = dataHeader['component']
+		#print(json.dumps(dataHeader, indent=4))
+		print(inFile)
+
+		if mon.ndim == 1:
+			I, sigI, N, L = mon.I, mon.sigI, mon.N, mon.L
+			stats = {key: values[position[id(mon)]] for key, values in batch.items()}
+
+			print("fwhm: "+str(stats['fwhm']))
+			print("wavelength: "+str(stats['wavelength'])+", intensity: "+str(stats['intensity']))
+			print("sum within fwhm: "+str(stats['sum'])+" ± "+str(stats['sum_err']))
+			print(f"integrated intensity per angstrom: {stats['integrated_per_angstrom']:.4e}")
+
+			unit = re.findall(r"\[(.*?)\]", dataHeader['xlabel'])
+			dx = (L[-1] - L[0]) / np.size(L)
+
+			if (args.noshow==0):
+				import matplotlib.pyplot as plt
+
+				plt.errorbar(L, I, yerr=sigI, fmt='o', capsize=2)
+				plt.xlabel(dataHeader['xlabel'])
+				plt.ylabel('Intensity [n/s]/ '+"{:.2e}".format(dx)+' ['+unit[0]+']')
+				plt.title(component, pad=10)
+				plt.show()
+
+				plt.plot(L, N)
+				plt.xlabel(dataHeader['xlabel'])
+				plt.ylabel('N/ '+"{:.2e}".format(dx)+' ['+unit[0]+']')
+				plt.title(component, pad=10)
+				plt.show()
+
+		else:
+			print("Unknown Data Type.")
@@ -0,0 +1,107 @@
+#!/bin/python3
+# Evaluate many ROIs on many 2d monitors in one process
+#
+# ROIs are read from a JSON file holding a list of objects, each with a name
+# and one shape, using the same conventions as count.py:
+#	[{"name": "beam", "square": [x0, x1, y0, y1]},
+#	 {"name": "core", "circle": [x0, y0, radius]},
+#	 {"name": "halo", "annulus": [x0, y0, r_in, r_out]}]
+# Every monitor is parsed once (through the monitor cache) by a pool of worker
+# processes, and each ROI mask is built once per geometry and worker. The
+# result is one table with a row per (file, ROI), written as CSV or, for a
+# .parquet output, with pandas. Files that are not 2d monitors are skipped
+# with a message on stderr.
+
+import os
+import sys
+import csv
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import mcstasHelper as mc
+from roiHelper import masked_sum
+
+COLUMNS = ['filename', 'roi', 'shape', 'sum', 'sum_err', 'area']
+
+def read_roi_spec(filename):
+	with open(filename, 'r') as f:
+		spec = json.load(f)
+
+	rois = []
+	for i, roi in enumerate(spec):
+		shapes = [key for key in ('square', 'rect', 'circle', 'annulus') if key in roi]
+		if len(shapes) != 1:
+			raise ValueError(f"ROI {i} in {filename} needs exactly one of square, circle or annulus")
+		shape = 'square' if shapes[0] == 'rect' else shapes[0]
+		limits = [float(v) for v in roi[shapes[0]]]
+		if len(limits) != {'square': 4, 'circle': 3, 'annulus': 4}[shape]:
+			raise ValueError(f"Wrong number of limits for {shape} ROI {i} in {filename}")
+		rois.append((roi.get('name', f'roi{i}'), shape, limits))
+	return rois
+
+def roi_area(shape, limits):
+	if shape == 'square':
+		x0, x1, y0, y1 = limits
+		return (x1-x0)*(y1-y0)
+	elif shape == 'circle':
+		return np.pi*limits[2]**2
+	return np.pi*(limits[3]**2 - limits[2]**2)
+
+# Worker: all ROIs on one monitor, returns a list of table rows. ROI masks
+# are cached per worker, so monitors sharing a geometry only gather pixels.
+# Files that are not 2d monitors or cannot be read are reported and skipped
+def count_file(filename, rois):
+	try:
+		mon = mc.loadMcStasMonitor(filename)
+		if mon.type[:8] != "array_2d":
+			raise ValueError("not a 2d monitor ("+mon.type+")")
+	except Exception as e:
+		print(f"{filename}: skipped, {e}", file=sys.stderr)
+		return []
+	rows = []
+	for name, shape, limits in rois:
+		roi_sum, sum_err = masked_sum(mon.I, mon.extent, (shape, limits))
+		rows.append([filename, name, shape, float(roi_sum), float(sum_err), roi_area(shape, limits)])
+	return rows
+
+def count_batch(filenames, rois, processes=None):
+	rows = []
+	with ProcessPoolExecutor(processes) as pool:
+		for file_rows in pool.map(count_file, filenames, [rois]*len(filenames), chunksize=4):
+			rows.extend(file_rows)
+	return rows
+
+def write_table(rows, outFile):
+	if outFile and outFile.endswith('.parquet'):
+		import pandas as pd
+		pd.DataFrame(rows, columns=COLUMNS).to_parquet(outFile, index=False)
+		return
+
+	f = open(outFile, 'w', newline='') if outFile else sys.stdout
+	try:
+		writer = csv.writer(f)
+		writer.writerow(COLUMNS)
+		writer.writerows(rows)
+	finally:
+		if outFile:
+			f.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Find counts within several ROIs for many McStas 2d monitors.')
+	parser.add_argument('rois', type=str, help='JSON file of ROI definitions')
+	parser.add_argument('files', nargs='+', help='monitor files or glob patterns (quote them to expand here)')
+	parser.add_argument('--out', type=str, help='output table, .csv or .parquet (default: CSV to stdout)')
+	parser.add_argument('--processes', type=int, help='number of worker processes (default: all cores)')
+	args = parser.parse_args()
+
+	rois = read_roi_spec(args.rois)
+
+	filenames = []
+	for pattern in args.files:
+		matches = sorted(glob.glob(pattern, recursive=True))
+		filenames.extend(matches if matches else [pattern])
+	filenames = [f for f in dict.fromkeys(filenames) if not os.path.isdir(f)]
+
+	write_table(count_batch(filenames, rois, args.processes), args.out)
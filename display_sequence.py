@@ -1,8 +1,11 @@
 # display evolution of beam profile through multiple time slices of instrument
 
 import mcstasHelper as mc
+from mcstasRun import loadMcStasMonitors
+from profileHelper import profile_metrics, monitor_metrics
 import argparse
 import glob
+from concurrent.futures import ProcessPoolExecutor
 import re
 import numpy as np
 import matplotlib.pyplot as plt
@@ -10,38 +13,13 @@ from PIL import Image
 from matplotlib.animation import FuncAnimation
 from matplotlib.ticker import ScalarFormatter
 
-def calculate_fwhm(x, y):
-	max_index = np.argmax(y)
-	x_max = x[max_index]
-	y_max = y[max_index]
-
-	half_max_y = y_max/2
-	closest_index = np.argmin(np.abs(y - half_max_y))
-
-	# Find left_idx where x is less than x_max
-	filtered_y = y[:max_index]
-	left_idx = np.argmin(np.abs(filtered_y - half_max_y))
-	x_left = x[left_idx]
-	#print(f'left: {x_left}')
-	
-	# Find right_idx where x is greater than x_max
-	filtered_y = y[max_index:]
-	right_idx = max_index + np.argmin(np.abs(filtered_y - half_max_y))
-	x_right = x[right_idx]
-	#print(f'right: {x_right}')
-
-	fwhm = x_left - x_right
-	return x_right, x_left, fwhm
-
 def plot_data(filename, plot_type):
-	I, sigI, N, dataHeader, L = mc.extractMcStasData(filename)
-
-	# Call the mcstas2TIFF function to generate .tif files
-	imN, imI, sigI = mc.mcstas2TIFF(filename, save=False)
-	extent = np.array(dataHeader['xylimits'].split(),dtype=float)
+	mon = mc.loadMcStasMonitor(filename)
+	I, sigI, dataHeader = mon.I, mon.sigI, mon.header
 	component = dataHeader['component']
 		
-	if dataHeader['type'][:8]=="array_2d":
+	if mon.ndim == 2:
+		extent = mon.extent
 		if plot_type == "full":
 			# Set axis limits ax.set_xlim(extent[0], extent[1])
 			ax.set_ylim(extent[2], extent[3])
@@ -50,10 +28,10 @@ def plot_data(filename, plot_type):
 			unit2 = re.findall(r"\[(.*?)\]", dataHeader['ylabel'])
 		
 			# Calculate bin size
-			dx = (extent[1] - extent[0]) / (np.array(imI).shape[1] - 1)
-			dy = (extent[3] - extent[2]) / (np.array(imI).shape[0] - 1)
+			dx = (extent[1] - extent[0]) / (I.shape[1] - 1)
+			dy = (extent[3] - extent[2]) / (I.shape[0] - 1)
 		
-			plt.imshow(np.array(imI), extent=extent, cmap='plasma', vmin=overall_min, vmax=overall_max)
+			plt.imshow(I, extent=extent, cmap='plasma', vmin=overall_min, vmax=overall_max)
 	
 			cbar = plt.colorbar()
 			cbar.set_label('Intensity [n/s]/ '+"{:.2e}".format(dx*dy)+' ['+unit1[0]+'*'+unit2[0]+']')
@@ -67,17 +45,18 @@ def plot_data(filename, plot_type):
 			plt.title(dataHeader['component']+"\npos=("+dataHeader['position']+")", pad=10)
 		elif plot_type == "x":
 			unit = re.findall(r"\[(.*?)\]", dataHeader['xlabel'])
-			dx = (extent[1] - extent[0]) / np.array(imI).shape[1]
+			dx = mon.dx
 	
 			# Generate X cross-section cross_section
-			cross_section = np.sum(np.array(imI), axis=0)  # Sum along the horizontal axis
-			err_cross_section = np.sqrt(np.sum(np.square(np.array(sigI)), axis=0))
+			cross_section = np.sum(I, axis=0)  # Sum along the horizontal axis
+			err_cross_section = np.sqrt(np.sum(np.square(sigI), axis=0))
 	
 			x = np.linspace(extent[0], extent[1], np.size(cross_section))
 			plt.errorbar(x, cross_section, err_cross_section, capsize=2)
 
 			# Calculate fwhm
-			x_right, x_left, fwhm = calculate_fwhm(x, cross_section)
+			metrics = profile_metrics(x, cross_section)
+			x_left, x_right, fwhm = metrics['left'][0], metrics['right'][0], metrics['fwhm'][0]
 			print(f"{dataHeader['position']} {fwhm}")
 
 			# Show fwhm
@@ -90,17 +69,18 @@ def plot_data(filename, plot_type):
 			plt.title("X Cross-Section: "+component+"\npos=("+dataHeader['position']+")", pad=10)
 		elif plot_type == "y":
 			unit = re.findall(r"\[(.*?)\]", dataHeader['ylabel'])
-			dx = (extent[3] - extent[2]) / np.array(imI).shape[0]
+			dx = mon.dy
 	
 			# Generate Y cross-section
-			cross_section = np.sum(np.array(imI), axis=1)  # Sum along the horizontal axis
-			err_cross_section = np.sqrt(np.sum(np.square(np.array(sigI)), axis=1))
+			cross_section = np.sum(I, axis=1)  # Sum along the horizontal axis
+			err_cross_section = np.sqrt(np.sum(np.square(sigI), axis=1))
 	
 			x = np.linspace(extent[3], extent[2], np.size(cross_section))
 			plt.errorbar(x, cross_section, err_cross_section, capsize=2)
 
 			# Calculate fwhm
-			x_right, x_left, fwhm = calculate_fwhm(x, cross_section)
+			metrics = profile_metrics(x[::-1], cross_section[::-1])
+			x_left, x_right, fwhm = metrics['left'][0], metrics['right'][0], metrics['fwhm'][0]
 			print(f"{dataHeader['position']} {fwhm}")
 
 			# Show fwhm
@@ -147,6 +127,19 @@ def on_key_press(event):
 		if not pause:
 			animation.event_source.start()
 
+# Worker: (min, max) of the plotted data of one frame, so only two numbers
+# per frame come back from the pool
+def frame_range(filename, plot_type):
+	I = mc.loadMcStasMonitor(filename).I
+
+	# if plot_type == "full":
+	dataset = I
+	if plot_type == "x":
+		dataset = np.sum(I, axis=0)  # Sum along the horizontal axis
+	elif plot_type == "y":
+		dataset = np.sum(I, axis=1)  # Sum along the vertical axis
+	return np.min(dataset), np.max(dataset)
+
 if __name__ == '__main__':
 	# Argument parsing
 	parser = argparse.ArgumentParser(description='Plot data from files as a video')
@@ -156,6 +149,7 @@ if __name__ == '__main__':
 	parser.add_argument("--start_string", default="file_", help="String to isolate the number")
 	parser.add_argument("--extension", default=".dat", help="File extension")
 	parser.add_argument('--save', metavar='outFile', help='if provided, save video as GIF with specified output file name')
+	parser.add_argument('--table', action='store_true', help='if true then only print a table of beam profile metrics for the sequence')
 	args = parser.parse_args()
 
 	start_string = args.start_string
@@ -175,6 +169,17 @@ if __name__ == '__main__':
 
 	print('sequence:\n', filenames)
 
+	# Beam evolution table: x/y centroid, rms, fwhm and 10-90% width of every monitor
+	if args.table:
+		monitors = loadMcStasMonitors(filenames)
+		metrics = monitor_metrics(monitors)
+		keys = ['centroid', 'rms', 'fwhm', 'width_10_90']
+		print('position ' + ' '.join(f'{axis}_{key}' for axis in ('x', 'y') for key in keys))
+		for i, mon in enumerate(monitors):
+			row = [metrics[axis][key][i] for axis in ('x', 'y') for key in keys]
+			print(mon.header['position'].replace(' ', ',') + ' ' + ' '.join(f'{v:.6g}' for v in row))
+		raise SystemExit
+
 	# Create the figure and axis for plotting
 	fig, ax = plt.subplots()
 
@@ -184,20 +189,13 @@ if __name__ == '__main__':
 	overall_min = np.inf
 	overall_max = -np.inf
 
-	for filename in filenames:
-		I, sigI, N, dataHeader, L = mc.extractMcStasData(filename)
-
-		# if plot_type == "full":
-		dataset = np.copy(I)
-		if args.plot_type == "x":
-			dataset = np.sum(np.array(I), axis=0)  # Sum along the horizontal axis
-		elif args.plot_type == "y":
-			dataset = np.sum(np.array(I), axis=1)  # Sum along the vertical axis
-		dataset_min = np.min(dataset)
-		dataset_max = np.max(dataset)
-
-		overall_min = min(overall_min, dataset_min)
-		overall_max = max(overall_max, dataset_max)
+	# parse the whole sequence in parallel, each worker reducing its frames to
+	# (min, max); with the monitor cache enabled (MCSTAS_CACHE != 0) the frames
+	# are then read back from the cache while animating
+	with ProcessPoolExecutor() as pool:
+		for dataset_min, dataset_max in pool.map(frame_range, filenames, [args.plot_type]*len(filenames)):
+			overall_min = min(overall_min, dataset_min)
+			overall_max = max(overall_max, dataset_max)
 	
 	# Plot the first dataset to initialize the colorbar
 	plot_data(filenames[0], args.plot_type)
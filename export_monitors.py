@@ -0,0 +1,150 @@
+#!/bin/python3
+# Batch export of McStas 2d monitors to a TIFF stack or an HDF5 archive
+#
+# All array_2d monitors found below the given files/directories are parsed in
+# a process pool and written to a single output file, so downstream tools and
+# ImageJ can load hundreds of frames without re-parsing ASCII:
+#	tiff: multi-page float32 ImageJ hyperstack, one frame per monitor with
+#		  channels I, I_err and N (one stack per image shape); headers and
+#		  extents are written to a .json file next to the stack. ImageJ has
+#		  no 64-bit integer or mixed-type hyperstacks, so N is float32 there
+#		  and only exact below 2^24 counts; the exact counts are written as
+#		  a uint64 (T, Y, X) stack to <stack>_N.tif
+#	hdf5: one group per monitor holding chunked, compressed I, sigI and N
+#		  datasets, with extent, header and source file as attributes
+
+import os
+import re
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import mcstasHelper as mc
+from mcstasCache import CACHE_DIRNAME
+
+# Find all array_2d monitor files among paths (files or directory trees).
+# Returns a list of (filename, (ny, nx)) read from the headers only
+def find_monitors(paths):
+	candidates = []
+	for path in paths:
+		if os.path.isdir(path):
+			for dirpath, dirnames, filenames in os.walk(path):
+				if CACHE_DIRNAME in dirnames:
+					dirnames.remove(CACHE_DIRNAME)
+				candidates.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+									if name.endswith('.dat') and name != 'mccode.dat')
+		else:
+			candidates.append(path)
+
+	monitors = []
+	for filename in candidates:
+		try:
+			dataHeader = mc.parseMcStasHeader(mc.readMcStasHeader(filename))
+		except (OSError, UnicodeDecodeError):
+			continue
+		if dataHeader.get('type', '')[:8] == "array_2d":
+			nx, ny = (int(v) for v in re.findall(r"\d+", dataHeader['type'][8:]))
+			monitors.append((filename, (ny, nx)))
+	return monitors
+
+# Worker: parse one monitor and return plain arrays for the writer
+def load_frame(filename):
+	mon = mc.loadMcStasMonitor(filename, cache=False)
+	return {'filename': filename, 'I': mon.I, 'sigI': mon.sigI, 'N': mon.N,
+			'extent': mon.extent, 'header': mon.header}
+
+# Results of func over items in order, like pool.map, but with at most window
+# tasks submitted and not yet consumed, so only that many parsed frames are
+# held in memory however many files there are
+def bounded_map(pool, func, items, window):
+	pending = deque()
+	for item in items:
+		if len(pending) >= window:
+			yield pending.popleft().result()
+		pending.append(pool.submit(func, item))
+	while pending:
+		yield pending.popleft().result()
+
+def frame_metadata(frame):
+	return {'filename': frame['filename'], 'extent': list(frame['extent']), 'header': frame['header']}
+
+def export_hdf5(frames, outFile, root=None):
+	import h5py
+	with h5py.File(outFile, 'w') as f:
+		for frame in frames:
+			name = os.path.relpath(frame['filename'], root) if root else frame['filename']
+			group = f.create_group(name.replace(os.sep, '/'))
+			for key in ('I', 'sigI', 'N'):
+				group.create_dataset(key, data=frame[key], chunks=True, compression='gzip', compression_opts=4, shuffle=True)
+			group.attrs['extent'] = frame['extent']
+			group.attrs['header'] = json.dumps(frame['header'])
+			group.attrs['filename'] = os.path.abspath(frame['filename'])
+			for key, value in frame['header'].items():
+				group.attrs['header_'+key] = value
+			print(name)
+
+# Write float32 (T, C=3, Y, X) ImageJ hyperstacks, one per image shape, and
+# the exact N counts as uint64 (T, Y, X) stacks next to them. Frames are
+# parsed by the pool, at most window at a time, while earlier pages are being
+# written
+def export_tiff(pool, monitors, outFile, window):
+	import tifffile
+
+	by_shape = {}
+	for filename, shape in monitors:
+		by_shape.setdefault(shape, []).append(filename)
+
+	base, ext = os.path.splitext(outFile)
+	for shape, filenames in by_shape.items():
+		name = outFile if len(by_shape) == 1 else f"{base}_{shape[1]}x{shape[0]}{ext}"
+		metadata = []
+		counts = tifffile.TiffWriter(os.path.splitext(name)[0]+'_N.tif', bigtiff=True)
+
+		def pages():
+			for frame in bounded_map(pool, load_frame, filenames, window):
+				metadata.append(frame_metadata(frame))
+				print(frame['filename'])
+				counts.write(np.rint(frame['N']).astype(np.uint64), contiguous=True)
+				for key in ('I', 'sigI', 'N'):
+					yield frame[key].astype(np.float32)
+
+		stack_shape = (len(filenames), 3) + shape
+		# ImageJ hyperstacks are limited to 4 GB, use BigTIFF beyond that
+		imagej = np.prod(stack_shape) * 4 < 2**32 - 2**25
+		labels = [f"{os.path.basename(filename)} {key}" for filename in filenames for key in ('I', 'sigI', 'N')]
+		with counts:
+			tifffile.imwrite(name, pages(), shape=stack_shape, dtype=np.float32,
+							 imagej=imagej, bigtiff=not imagej,
+							 metadata={'axes': 'TCYX', 'Labels': labels} if imagej else {'axes': 'TCYX'})
+
+		with open(os.path.splitext(name)[0]+'.json', 'w') as f:
+			json.dump(metadata, f, indent=1)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Export McStas 2d monitors to a TIFF stack or HDF5 archive')
+	parser.add_argument('paths', nargs='+', help='monitor files or directories to search')
+	parser.add_argument('--out', required=True, help='output file (.tif/.tiff or .h5/.hdf5)')
+	parser.add_argument('--format', choices=['tiff', 'hdf5'], help='output format (default: from --out extension)')
+	parser.add_argument('--processes', type=int, help='number of worker processes (default: all cores)')
+	args = parser.parse_args()
+
+	fmt = args.format
+	if fmt is None:
+		fmt = 'hdf5' if os.path.splitext(args.out)[1].lower() in ('.h5', '.hdf5', '.nxs') else 'tiff'
+
+	monitors = find_monitors(args.paths)
+	print(f"exporting {len(monitors)} monitors to {args.out}")
+
+	root = os.path.commonpath([os.path.abspath(p) for p in args.paths]) if args.paths else None
+	if root and not os.path.isdir(root):
+		root = os.path.dirname(root)
+
+	# two frames per worker in flight keep the pool busy while one is written
+	window = 2 * (args.processes or os.cpu_count() or 1)
+	with ProcessPoolExecutor(args.processes) as pool:
+		if fmt == 'hdf5':
+			frames = bounded_map(pool, load_frame, [filename for filename, shape in monitors], window)
+			export_hdf5(frames, args.out, root)
+		else:
+			export_tiff(pool, monitors, args.out, window)
@@ -0,0 +1,241 @@
+#!/bin/python3
+# On-disk cache for parsed McStas monitors
+#
+# Parsed data is stored as a .npy sidecar (plus a .json holding the header and
+# cache key) in a __mcstascache__ directory next to the source file, similar to
+# __pycache__. Repeat loads memory-map the .npy instead of re-parsing the ASCII.
+# Entries are keyed on absolute path, mtime and size of the source, so editing
+# or re-running a simulation invalidates them automatically.
+#
+# The cap is on the total size of all cache directories. Every store appends
+# its change in size to a ledger file shared by all processes, so the total is
+# known without listing any directory. Only when a store takes the total past
+# the cap are the directories in the ledger scanned, and the least recently
+# used entries among all of them are evicted.
+#
+# Environment variables:
+#	MCSTAS_CACHE=0				disable the cache
+#	MCSTAS_CACHE_MAX_BYTES		total size cap of all cache directories (default 10 GB)
+#	MCSTAS_CACHE_LEDGER			size ledger (default ~/.cache/mcstas/usage.tsv)
+
+import os
+import json
+import numpy as np
+
+CACHE_DIRNAME = '__mcstascache__'
+ENABLED = os.environ.get('MCSTAS_CACHE', '1') != '0'
+MAX_BYTES = int(os.environ.get('MCSTAS_CACHE_MAX_BYTES', 10*1024**3))
+LEDGER = os.environ.get('MCSTAS_CACHE_LEDGER', os.path.join(os.path.expanduser('~'), '.cache', 'mcstas', 'usage.tsv'))
+# the ledger is rewritten as one line per cache directory beyond this size
+LEDGER_COMPACT_BYTES = 1<<20
+
+# cache directory -> bytes, as read so far from the ledger by this process
+_ledger = {'ino': None, 'offset': 0, 'dirs': {}}
+
+# Paths of the cache entry of filename: (cache directory, .npy, .json). Other
+# kinds of data for the same source are told apart by suffix
+def cache_paths(filename, suffix=''):
+	dirname, basename = os.path.split(os.path.abspath(filename))
+	cache_dir = os.path.join(dirname, CACHE_DIRNAME)
+	base = os.path.join(cache_dir, basename+suffix)
+	return cache_dir, base+'.npy', base+'.json'
+
+def cache_key(filename):
+	st = os.stat(filename)
+	return {'path': os.path.abspath(filename), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+# Header (or other metadata) stored for filename if its entry is valid, else None
+def cached_meta(filename, suffix=''):
+	cache_dir, npy_file, meta_file = cache_paths(filename, suffix)
+	try:
+		with open(meta_file, 'r') as f:
+			meta = json.load(f)
+		if meta['key'] == cache_key(filename) and os.path.isfile(npy_file):
+			# mark entry as recently used for LRU eviction
+			os.utime(meta_file)
+			return meta
+	except (OSError, ValueError, KeyError):
+		pass
+	return None
+
+# Return (header lines, data) for filename, from the cache if valid, otherwise
+# from reader(filename), which is then stored for next time
+def cached_read(filename, reader, enabled=None):
+	if enabled is None:
+		enabled = ENABLED
+	if not enabled:
+		return reader(filename)
+
+	meta = cached_meta(filename)
+	if meta is not None:
+		try:
+			return meta['header'], np.load(cache_paths(filename)[1], mmap_mode='c')
+		except (OSError, ValueError):
+			pass
+
+	key = cache_key(filename)
+	raw, data = reader(filename)
+	try:
+		store(filename, key, raw, data)
+	except OSError:
+		# read-only or full data directories are simply not cached
+		pass
+	return raw, data
+
+def store(filename, key, raw, data):
+	write_entry(filename, {'key': key, 'header': raw}, lambda f: np.save(f, np.ascontiguousarray(data)))
+
+# Write path through a temporary file renamed into place, so readers never see
+# a partial file; the temporary file is removed if write(f) raises
+def atomic_write(path, write, mode='wb'):
+	tmp = path+'.%d.tmp' % os.getpid()
+	try:
+		with open(tmp, mode) as f:
+			write(f)
+		os.replace(tmp, path)
+	finally:
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+# Write the cache entry of filename: write_npy(f) writes the .npy, meta goes to
+# the .json. The old .json is removed first and the new one written last, so
+# a .json always belongs to the complete .npy next to it
+def write_entry(filename, meta, write_npy, suffix=''):
+	cache_dir, npy_file, meta_file = cache_paths(filename, suffix)
+	os.makedirs(cache_dir, exist_ok=True)
+	old_size = entry_size(meta_file, npy_file)
+	if os.path.exists(meta_file):
+		os.remove(meta_file)
+
+	atomic_write(npy_file, write_npy)
+	atomic_write(meta_file, lambda f: json.dump(meta, f), 'w')
+
+	record(cache_dir, entry_size(meta_file, npy_file) - old_size)
+	if sum(read_ledger().values()) > MAX_BYTES:
+		evict(keep=meta_file)
+	return npy_file
+
+def entry_size(meta_file, npy_file):
+	size = 0
+	for path in (meta_file, npy_file):
+		try:
+			size += os.path.getsize(path)
+		except OSError:
+			pass
+	return size
+
+# Append a change in size of cache_dir to the ledger. Lines are appended with
+# one write, so concurrent processes do not lose each other's updates
+def record(cache_dir, delta):
+	if delta == 0:
+		return
+	os.makedirs(os.path.dirname(LEDGER), exist_ok=True)
+	with open(LEDGER, 'a') as f:
+		f.write('%d\t%s\n' % (delta, cache_dir))
+	if os.path.getsize(LEDGER) > LEDGER_COMPACT_BYTES:
+		write_ledger(read_ledger())
+
+# Sizes of all known cache directories. Only the lines appended since the last
+# call are read, unless the ledger was rewritten in the meantime
+def read_ledger():
+	try:
+		st = os.stat(LEDGER)
+	except OSError:
+		_ledger.update(ino=None, offset=0, dirs={})
+		return _ledger['dirs']
+	if st.st_ino != _ledger['ino'] or st.st_size < _ledger['offset']:
+		_ledger.update(ino=st.st_ino, offset=0, dirs={})
+
+	with open(LEDGER, 'rb') as f:
+		f.seek(_ledger['offset'])
+		data = f.read()
+	# a line still being appended is read next time
+	data = data[:data.rfind(b'\n')+1]
+	_ledger['offset'] += len(data)
+
+	dirs = _ledger['dirs']
+	for line in data.decode().splitlines():
+		try:
+			delta, cache_dir = line.split('\t', 1)
+			dirs[cache_dir] = dirs.get(cache_dir, 0) + int(delta)
+		except ValueError:
+			continue
+	return dirs
+
+# Replace the ledger by one line per cache directory. Lines appended by other
+# processes meanwhile are lost, which the next eviction corrects by measuring
+def write_ledger(dirs):
+	os.makedirs(os.path.dirname(LEDGER), exist_ok=True)
+	atomic_write(LEDGER, lambda f: f.write(''.join('%d\t%s\n' % (size, d) for d, size in dirs.items() if size > 0)), 'w')
+	_ledger.update(ino=None, offset=0, dirs={})
+
+# Entries of one cache directory: (last used, size, .json, .npy)
+def list_entries(cache_dir):
+	entries = []
+	try:
+		names = os.listdir(cache_dir)
+	except OSError:
+		return entries
+	for name in names:
+		if not name.endswith('.json'):
+			continue
+		meta_file = os.path.join(cache_dir, name)
+		npy_file = meta_file[:-len('.json')]+'.npy'
+		try:
+			size = os.path.getsize(meta_file) + os.path.getsize(npy_file)
+			last_used = os.path.getmtime(meta_file)
+		except OSError:
+			continue
+		entries.append((last_used, size, meta_file, npy_file))
+	return entries
+
+def remove_entry(meta_file, npy_file):
+	for path in (meta_file, npy_file):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+# Remove least recently used entries of all cache directories in the ledger
+# until their total is below max_bytes, except the entry with .json keep. The
+# ledger is then rewritten with the measured sizes
+def evict(max_bytes=None, keep=None):
+	if max_bytes is None:
+		max_bytes = MAX_BYTES
+
+	sizes = {}
+	entries = []
+	for cache_dir in list(read_ledger()):
+		dir_entries = list_entries(cache_dir)
+		sizes[cache_dir] = sum(entry[1] for entry in dir_entries)
+		entries.extend(entry + (cache_dir,) for entry in dir_entries)
+
+	total = sum(sizes.values())
+	entries.sort()
+	for last_used, size, meta_file, npy_file, cache_dir in entries:
+		if total <= max_bytes:
+			break
+		if meta_file == keep:
+			continue
+		remove_entry(meta_file, npy_file)
+		total -= size
+		sizes[cache_dir] -= size
+	write_ledger(sizes)
+
+# Delete every cache entry in the given data directory
+def clear(dirname):
+	cache_dir = os.path.join(os.path.abspath(dirname), CACHE_DIRNAME)
+	removed = 0
+	for last_used, size, meta_file, npy_file in list_entries(cache_dir):
+		remove_entry(meta_file, npy_file)
+		removed += size
+	record(cache_dir, -removed)
+
+# True if filename has a valid cache entry
+def is_cached(filename):
+	cache_dir, npy_file, meta_file = cache_paths(filename)
+	try:
+		with open(meta_file, 'r') as f:
+			return json.load(f)['key'] == cache_key(filename)
+	except (OSError, ValueError, KeyError):
+		return False
@@ -0,0 +1,172 @@
+#!/bin/python3
+# Header-only catalog of McStas simulation archives
+#
+# Scans directory trees (e.g. the run_<hash> directories written by
+# optimization_scripts/run_mcstas.py) and records the '#' header of every
+# monitor file in an SQLite database, reading each file only up to its first
+# data line. Re-scanning only re-reads files whose mtime or size changed and
+# drops files that no longer exist, so the catalog can be updated as new runs
+# appear. Queries then run against the database instead of the ASCII data.
+#
+#	python3 mcstasCatalog.py scan catalog.db runs/
+#	python3 mcstasCatalog.py query catalog.db --component Sample_Position_spectrum --param N=8
+
+import os
+import json
+import sqlite3
+import argparse
+import mcstasHelper as mc
+from mcstasCache import CACHE_DIRNAME
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS monitors (
+	path TEXT PRIMARY KEY,
+	run_dir TEXT,
+	mtime_ns INTEGER,
+	size INTEGER,
+	component TEXT,
+	type TEXT,
+	title TEXT,
+	x REAL,
+	y REAL,
+	z REAL,
+	xylimits TEXT,
+	parameters TEXT,
+	header TEXT
+);
+CREATE INDEX IF NOT EXISTS monitors_component ON monitors (component);
+CREATE INDEX IF NOT EXISTS monitors_run_dir ON monitors (run_dir);
+CREATE INDEX IF NOT EXISTS monitors_z ON monitors (z);
+'''
+
+COLUMNS = ('path', 'run_dir', 'mtime_ns', 'size', 'component', 'type', 'title', 'x', 'y', 'z', 'xylimits', 'parameters', 'header')
+
+def connect(db_file):
+	con = sqlite3.connect(db_file)
+	con.executescript(SCHEMA)
+	return con
+
+# Build a catalog row from the header of one monitor file
+def catalog_entry(path, st):
+	raw = mc.readMcStasHeader(path)
+	header = mc.parseMcStasHeader(raw)
+
+	# the header dict keeps only the last 'Param' line, collect all of them here
+	parameters = {}
+	for line in raw:
+		if line.startswith('Param: '):
+			name, _, value = line[7:].partition('=')
+			parameters[name.strip()] = value.strip()
+
+	try:
+		x, y, z = (float(v) for v in header['position'].split())
+	except (KeyError, ValueError):
+		x, y, z = None, None, None
+
+	limits = header.get('xylimits', header.get('xlimits'))
+	return (path, os.path.dirname(path), st.st_mtime_ns, st.st_size,
+			header.get('component'), header.get('type'), header.get('title'),
+			x, y, z, limits, json.dumps(parameters), json.dumps(header))
+
+# Walk the given roots and bring the catalog up to date.
+# Returns the number of (added or changed, removed) files
+def scan(con, roots):
+	known = {}
+	for root in roots:
+		root = os.path.abspath(root)
+		prefix = os.path.join(root, '')
+		for path, mtime_ns, size in con.execute("SELECT path, mtime_ns, size FROM monitors WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)):
+			known[path] = (mtime_ns, size)
+
+	updated = []
+	seen = set()
+	for root in roots:
+		for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+			if CACHE_DIRNAME in dirnames:
+				dirnames.remove(CACHE_DIRNAME)
+			for name in filenames:
+				if not name.endswith('.dat') or name == 'mccode.dat':
+					continue
+				path = os.path.join(dirpath, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				seen.add(path)
+				if known.get(path) == (st.st_mtime_ns, st.st_size):
+					continue
+				try:
+					updated.append(catalog_entry(path, st))
+				except (OSError, UnicodeDecodeError):
+					# not a readable McStas text file
+					continue
+
+	removed = [(path,) for path in known if path not in seen]
+	with con:
+		con.executemany("INSERT OR REPLACE INTO monitors VALUES (%s)" % ','.join('?'*len(COLUMNS)), updated)
+		con.executemany("DELETE FROM monitors WHERE path = ?", removed)
+	return len(updated), len(removed)
+
+# Select catalog rows; params is a dict of simulation parameters that must match exactly
+def query(con, component=None, type=None, run_dir=None, zmin=None, zmax=None, params=None):
+	clauses = []
+	values = []
+	if component is not None:
+		clauses.append("component = ?")
+		values.append(component)
+	if type is not None:
+		clauses.append("substr(type, 1, ?) = ?")
+		values.extend([len(type), type])
+	if run_dir is not None:
+		clauses.append("run_dir = ?")
+		values.append(os.path.abspath(run_dir))
+	if zmin is not None:
+		clauses.append("z >= ?")
+		values.append(zmin)
+	if zmax is not None:
+		clauses.append("z <= ?")
+		values.append(zmax)
+	for name, value in (params or {}).items():
+		clauses.append("json_extract(parameters, ?) = ?")
+		values.extend(['$."%s"' % name, str(value)])
+
+	sql = "SELECT %s FROM monitors" % ', '.join(COLUMNS)
+	if clauses:
+		sql += " WHERE " + " AND ".join(clauses)
+	sql += " ORDER BY run_dir, z"
+
+	rows = []
+	for row in con.execute(sql, values):
+		row = dict(zip(COLUMNS, row))
+		row['parameters'] = json.loads(row['parameters'])
+		row['header'] = json.loads(row['header'])
+		rows.append(row)
+	return rows
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Header-only catalog of McStas monitor files')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	scan_parser = subparsers.add_parser('scan', help='add new or changed monitor files to the catalog')
+	scan_parser.add_argument('db', help='SQLite catalog file')
+	scan_parser.add_argument('roots', nargs='+', help='directories to scan')
+
+	query_parser = subparsers.add_parser('query', help='list catalogued monitor files')
+	query_parser.add_argument('db', help='SQLite catalog file')
+	query_parser.add_argument('--component', help='component name')
+	query_parser.add_argument('--type', help="data type prefix, e.g. 'array_2d'")
+	query_parser.add_argument('--run', help='run directory')
+	query_parser.add_argument('--z', nargs=2, type=float, metavar=('zmin', 'zmax'), help='component z position range [m]')
+	query_parser.add_argument('--param', action='append', default=[], metavar='name=value', help='simulation parameter value (repeatable)')
+
+	args = parser.parse_args()
+	con = connect(args.db)
+
+	if args.command == 'scan':
+		n_updated, n_removed = scan(con, args.roots)
+		print(f"{n_updated} files added or updated, {n_removed} removed")
+	else:
+		params = dict(p.split('=', 1) for p in args.param)
+		zmin, zmax = args.z if args.z else (None, None)
+		for row in query(con, args.component, args.type, args.run, zmin, zmax, params):
+			print(f"{row['path']}  {row['component']}  {row['type']}  ({row['x']}, {row['y']}, {row['z']})m")
@@ -0,0 +1,156 @@
+#!/bin/python3
+# Reader for McStas list-mode / Monitor_nD event output
+#
+# Event lists are text files with one event per row (optionally preceded by a
+# '#' header whose 'variables' line names the columns). The first load
+# converts the text once, block by block, to a .npy file of a structured dtype
+# in the monitor cache (see mcstasCache.py); later loads memory-map that file,
+# so selecting columns, filtering and histogramming work without reading
+# everything into memory, also for lists larger than RAM. The conversion is
+# redone automatically when the source file changes (path, mtime and size are
+# checked) or its cache entry was evicted.
+#
+#	events = loadEvents('Monolith_events_list.dat')
+#	H, xedges, yedges = histogramEvents(events, 'x', 'z', bins=(200, 400))
+
+import re
+import numpy as np
+import mcstasHelper as mc
+import mcstasCache
+
+# cache entries of event lists are told apart from parsed monitors by suffix
+EVENTS_SUFFIX = '.events'
+
+# Column names from the header 'variables' line, or col0, col1, ... if absent
+def column_names(raw, ncols):
+	variables = mc.findMcStasHeaderValue(raw, 'variables')
+	names = variables.split() if variables else []
+	if len(names) != ncols:
+		names = ['col%d' % i for i in range(ncols)]
+
+	# structured dtype fields must be unique identifiers
+	unique = []
+	for name in names:
+		name = re.sub(r'\W', '_', name)
+		while name in unique:
+			name += '_'
+		unique.append(name)
+	return unique
+
+# .npy (version 1.0) header for n_rows records of dtype, padded with spaces
+# to `length` bytes so it can be rewritten in place once n_rows is known
+def npy_header(dtype, n_rows, length=None):
+	header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), n_rows)
+	if length is None:
+		# total size (10 byte preamble + header + newline) is a multiple of 64
+		length = -(-(10 + len(header) + 1) // 64) * 64
+	header = header.ljust(length - 10 - 1) + '\n'
+	return b'\x93NUMPY\x01\x00' + np.uint16(len(header)).tobytes() + header.encode('latin1')
+
+# Convert a text event list to a structured .npy file in the monitor cache,
+# parsing blocks of about block_size bytes at a time. Returns the path of the
+# .npy file
+def convertEvents(filename, block_size=1<<25):
+	key = mcstasCache.cache_key(filename)
+	raw = mc.readMcStasHeader(filename)
+	return mcstasCache.write_entry(filename, {'key': key, 'header': raw},
+								   lambda out: writeEvents(filename, raw, out, block_size), EVENTS_SUFFIX)
+
+# Write the events of a text event list to the open file out as .npy
+def writeEvents(filename, raw, out, block_size):
+	dtype = None
+	n_rows = 0
+	with open(filename, 'rb') as f:
+		rest = b''
+		while True:
+			block = f.read(block_size)
+			if not block and not rest:
+				break
+			# only parse complete lines, carry the tail over to the next block
+			block = rest + block
+			cut = block.rfind(b'\n') + 1 if len(block) == len(rest) + block_size else len(block)
+			if cut == 0:
+				cut = len(block)
+			block, rest = block[:cut], block[cut:]
+			if b'#' in block:
+				block = re.sub(rb'(?m)^#.*\n?', b'', block)
+			values = np.fromstring(block, sep=' ')
+			if values.size == 0:
+				continue
+
+			if dtype is None:
+				# column count from the first data line
+				n_cols = len(block.lstrip().split(b'\n', 1)[0].split())
+				dtype = np.dtype([(name, np.float64) for name in column_names(raw, n_cols)])
+				# reserve space for a header large enough for any row count
+				header_length = len(npy_header(dtype, 10**18))
+				out.write(npy_header(dtype, 0, header_length))
+			if values.size % n_cols != 0:
+				raise ValueError("Ragged event rows in "+filename)
+			out.write(values.tobytes())
+			n_rows += values.size // n_cols
+
+	if dtype is None:
+		raise ValueError("No events in "+filename)
+	out.seek(0)
+	out.write(npy_header(dtype, n_rows, header_length))
+
+# Memory-mapped structured array of the events in filename, converting the
+# text list first if needed. Also accepts an already converted .npy file
+def loadEvents(filename, mode='r'):
+	if filename.endswith('.npy'):
+		return np.load(filename, mmap_mode=mode)
+
+	if mcstasCache.cached_meta(filename, EVENTS_SUFFIX) is None:
+		convertEvents(filename)
+	return np.load(mcstasCache.cache_paths(filename, EVENTS_SUFFIX)[1], mmap_mode=mode)
+
+# Header lines of the source event list
+def eventHeader(filename):
+	return mc.parseMcStasHeader(mc.readMcStasHeader(filename))
+
+# Iterate over consecutive slices of at most chunk_rows events
+def iterEvents(events, chunk_rows=1<<22):
+	for start in range(0, len(events), chunk_rows):
+		yield events[start:start+chunk_rows]
+
+# 1d or 2d histogram of event columns, accumulated chunk by chunk so memory
+# use does not depend on the number of events. select is an optional function
+# of a chunk returning a boolean mask of events to keep; weights names a
+# weight column (e.g. 'p'). limits is the histogram range as in np.histogram
+# and np.histogram2d. Raises ValueError if no event is selected
+def histogramEvents(events, x, y=None, bins=100, limits=None, weights=None, select=None, chunk_rows=1<<22):
+	# fix the bin edges first, from the full column range if not given
+	if limits is None:
+		columns = [x] if y is None else [x, y]
+		lo = np.full(len(columns), np.inf)
+		hi = np.full(len(columns), -np.inf)
+		for chunk in iterEvents(events, chunk_rows):
+			if select is not None:
+				chunk = chunk[select(chunk)]
+			for i, name in enumerate(columns):
+				if len(chunk):
+					lo[i] = min(lo[i], np.min(chunk[name]))
+					hi[i] = max(hi[i], np.max(chunk[name]))
+		if not np.all(np.isfinite(lo)):
+			raise ValueError("no events selected")
+		limits = list(zip(lo, hi)) if y is not None else (lo[0], hi[0])
+
+	H = None
+	selected = 0
+	for chunk in iterEvents(events, chunk_rows):
+		if select is not None:
+			chunk = chunk[select(chunk)]
+		selected += len(chunk)
+		w = None if weights is None else chunk[weights]
+		if y is None:
+			h, edges = np.histogram(chunk[x], bins=bins, range=limits, weights=w)
+		else:
+			h, xedges, yedges = np.histogram2d(chunk[x], chunk[y], bins=bins, range=limits, weights=w)
+		H = h if H is None else H + h
+	if selected == 0:
+		raise ValueError("no events selected")
+
+	if y is None:
+		return H, edges
+	return H, xedges, yedges
@@ -1,19 +1,55 @@
 #!/bin/python3
 #McStas Helpers
 
-from PIL import Image
-from numpy import *#genfromtxt
-import matplotlib.pyplot as plt
-import tifffile
+import numpy as np
+import mcstasCache
 
-def extractMcStasData(filename):
-	data = genfromtxt(filename)
+# Read a McStas monitor file in one pass, splitting the leading '#' header
+# lines from the numeric rows. Returns (header lines, 2d data array)
+def readMcStasFile(filename):
 	raw = []
+	rows = []
 	with open(filename, 'r') as f:
-		while True:
-			r = f.readline()
-			if (r[0]=="#"): raw.append(r[2:-1])
-			else: break
+		for r in f:
+			if (r[0]=="#"):
+				# header ends at the first data row, later '#' lines only separate the I/I_err/N blocks
+				if not rows: raw.append(r[2:-1])
+			elif r.strip():
+				rows.append(r)
+	# parse all numbers with a single C-level call instead of genfromtxt
+	try:
+		data = np.fromstring(''.join(rows), sep=' ')
+	except ValueError as e:
+		raise ValueError("Malformed McStas data block in "+filename+": "+str(e)) from e
+	if len(rows)==0 or data.size % len(rows) != 0:
+		raise ValueError("Malformed McStas data block in "+filename)
+	return raw, data.reshape(len(rows), -1)
+
+# Binary monitor container: a .npz with the header lines (without '# ') in
+# 'header' and the stacked data rows of the text file in 'data'. Written by
+# writeMcStasNPZ and by analyze_GP-SANS/MNO_to_intensityPSD.cpp
+def readMcStasNPZ(filename):
+	with np.load(filename, allow_pickle=False) as f:
+		header = f['header']
+		# byte strings from the C++ converter
+		if header.dtype.kind == 'S': header = np.char.decode(header, 'utf-8')
+		return [str(line) for line in header], f['data']
+
+def writeMcStasNPZ(filename, mon, compressed=True):
+	save = np.savez_compressed if compressed else np.savez
+	with open(filename, 'wb') as f:
+		save(f, header=np.array(mon.raw, dtype=str), data=np.asarray(mon.data, dtype=np.float64))
+
+# Read only the leading '#' header lines, stopping at the first data row
+def readMcStasHeader(filename):
+	raw = []
+	with open(filename, 'r') as f:
+		for r in f:
+			if (r[0]!="#"): break
+			raw.append(r[2:-1])
+	return raw
+
+def parseMcStasHeader(raw):
 	dataHeader = {}
 	for i in raw:
 		t = i.split(": ")
@@ -22,53 +58,134 @@ def extractMcStasData(filename):
 			dataHeader[t[0]]=t[1]	
 		except:
 			break
-	if dataHeader['type'][:8]=="array_2d":
-		s = shape(data)
-		I = data[:s[0]//3]
-		sigI = data[s[0]//3:s[0]//3*2]
-		N = data[2*s[0]//3:]
-		L = []
-	elif dataHeader['type'][:8]=="array_1d":
-		L = data[:,0]
-		I = data[:,1]
-		sigI = data[:,2]
-		N = data[:,3]
+	return dataHeader
+
+# Look up a single header value without building the full header dict
+def findMcStasHeaderValue(raw, key):
+	prefix = key+": "
+	for i in raw:
+		if i.startswith(prefix): return i.split(": ")[1]
+	return None
+
+# Raised for monitors whose header type is neither array_1d nor array_2d
+class UnknownDataType(ValueError):
+	pass
+
+# Parsed McStas monitor. All arrays are views into one contiguous data buffer:
+# for array_2d data the I, I_err and N blocks are stacked row-wise, for
+# array_1d data the L, I, I_err and N columns sit side by side. The header
+# dict is only built when first accessed.
+class McStasMonitor:
+	__slots__ = ('filename', 'raw', 'data', 'type', 'ndim', 'I', 'sigI', 'N', 'L', 'extent', 'dx', 'dy', '_header')
+
+	def __init__(self, filename, raw, data):
+		self.filename = filename
+		self.raw = raw
+		self.data = data
+		self._header = None
+		self.type = findMcStasHeaderValue(raw, 'type')
+		if self.type is None: self.type = ''
+
+		if self.type[:8]=="array_2d":
+			ny = data.shape[0]//3
+			self.ndim = 2
+			self.I = data[:ny]
+			self.sigI = data[ny:2*ny]
+			self.N = data[2*ny:3*ny]
+			self.L = []
+			# physical extent [xmin, xmax, ymin, ymax] and bin size
+			xylimits = findMcStasHeaderValue(raw, 'xylimits')
+			if xylimits is None:
+				raise ValueError("No xylimits in the header of array_2d data in "+str(filename))
+			self.extent = np.array(xylimits.split(), dtype=float)
+			self.dx = (self.extent[1] - self.extent[0]) / self.I.shape[1]
+			self.dy = (self.extent[3] - self.extent[2]) / self.I.shape[0]
+		elif self.type[:8]=="array_1d":
+			self.ndim = 1
+			self.L = data[:,0]
+			self.I = data[:,1]
+			self.sigI = data[:,2]
+			self.N = data[:,3]
+			xlimits = findMcStasHeaderValue(raw, 'xlimits')
+			if xlimits is None: self.extent = np.array([self.L[0], self.L[-1]])
+			else: self.extent = np.array(xlimits.split(), dtype=float)
+			self.dx = (self.extent[1] - self.extent[0]) / np.size(self.L)
+			self.dy = None
+		else:
+			raise UnknownDataType("Unknown Data Type.")
+
+	@property
+	def header(self):
+		if self._header is None:
+			self._header = parseMcStasHeader(self.raw)
+		return self._header
+
+	@property
+	def shape(self):
+		return self.I.shape
+
+	# rebuild the views on unpickling instead of copying each array separately
+	def __reduce__(self):
+		return (McStasMonitor, (self.filename, self.raw, self.data))
+
+	def __repr__(self):
+		return "McStasMonitor(%r, %s, shape=%s)" % (self.filename, self.type, self.shape)
+
+# cache=False bypasses the on-disk cache of parsed monitors (see mcstasCache.py).
+# .npz monitors are read directly
+def loadMcStasMonitor(filename, cache=None):
+	if filename.endswith('.npz'):
+		raw, data = readMcStasNPZ(filename)
 	else:
+		raw, data = mcstasCache.cached_read(filename, readMcStasFile, cache)
+	return McStasMonitor(filename, raw, data)
+
+# Legacy tuple interface, returns views of a McStasMonitor
+def extractMcStasData(filename, cache=None):
+	try:
+		mon = loadMcStasMonitor(filename, cache)
+	except UnknownDataType:
 		print("Unknown Data Type.")
 		return -1
-	return I, sigI, N, dataHeader, L
+	return mon.I, mon.sigI, mon.N, mon.header, mon.L
 
+# Sum groups of I neighbouring bins, see rebinHelper.py for errors, 2d data and regridding
 def rebin(a,I):
-	newa = zeros(len(a)//I)
-	for i in arange(I): newa+=a[i::I]
-	return newa	
+	from rebinHelper import rebin_array
+	return rebin_array(a, I)
 
 # For 1d array data
 def mcstas2np(filename, statsOnly=True):
 	if statsOnly:
-		I, sigI, N, dataHeader, L = extractMcStasData(filename)
-		arr_I, arr_sigI, arr_N, arr_L = array(I), array(sigI), array(N), array(L) 
-		return arr_I, arr_sigI, arr_N, arr_L 
+		mon = loadMcStasMonitor(filename)
+		return mon.I, mon.sigI, mon.N, mon.L
 		
 # For 2d array data
 def mcstas2TIFF(filename, statsOnly=True, save=False):
 	if statsOnly:
-		I, sigI, N, dataHeader, L = extractMcStasData(filename)
-		tiffFilename = filename+".tif"
-		xmin,xmax,ymin,ymax = array(dataHeader['xylimits'].split(),dtype=float)
-		s = shape(N)
-		xres = s[0]/(xmax-xmin)/100
-		yres = s[1]/(ymax-ymin)/100
-		#print(xres,yres)
-		imN = Image.fromarray(array(N,dtype=uint16),mode='I;16')
-		imI = Image.fromarray(array(I,dtype=float32),mode='F')
-		if save:
-			imN.save(filename+"_N.tif", resolution_unit=3, x_resolution=xres, y_resolution=yres)
-			imI.save(filename+"_I.tif", resolution_unit=3, x_resolution=xres, y_resolution=yres)
-		else:
-			return imN, imI, sigI
+		return monitor2TIFF(loadMcStasMonitor(filename), save)
+
+def monitor2TIFF(mon, save=False):
+	from PIL import Image
+	filename = mon.filename
+	xmin,xmax,ymin,ymax = mon.extent
+	s = np.shape(mon.N)
+	xres = s[0]/(xmax-xmin)/100
+	yres = s[1]/(ymax-ymin)/100
+	#print(xres,yres)
+	# 32-bit counts, uint16 silently wrapped around above 65535 events per bin
+	imN = Image.fromarray(np.clip(np.rint(mon.N), 0, np.iinfo(np.int32).max).astype(np.int32),mode='I')
+	imI = Image.fromarray(mon.I.astype(np.float32),mode='F')
+	if save:
+		imN.save(filename+"_N.tif", resolution_unit=3, x_resolution=xres, y_resolution=yres)
+		imI.save(filename+"_I.tif", resolution_unit=3, x_resolution=xres, y_resolution=yres)
+	else:
+		return imN, imI, mon.sigI
 
 def show_tiff(filename, extent, xlabel, ylabel):
+	import matplotlib.pyplot as plt
+	import tifffile
+
 	# Load tiff file data
 	data = tifffile.imread(filename, is_ome=False)
 
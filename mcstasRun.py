@@ -0,0 +1,151 @@
+#!/bin/python3
+# Whole-run loader for mcrun output directories
+#
+# McStasRun reads mccode.sim to find every monitor written by a simulation and
+# behaves like a read-only dict of McStasMonitor objects keyed by file name
+# (without .dat). Monitors are only parsed when accessed; prefetch() parses a
+# set of them concurrently in a process pool so later access is immediate.
+#
+#	run = McStasRun('run_<hash>')
+#	run.prefetch()							# optional, parse everything in parallel
+#	spectrum = run['Sample_Position_spectrum']
+
+import os
+import glob
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import mcstasHelper as mc
+import mcstasCache
+
+# Parse mccode.sim into the simulation info and one dict per 'begin data' block
+def readMcCodeSim(filename):
+	sim_info = {}
+	data_blocks = []
+	section = None
+	block = None
+	with open(filename, 'r') as f:
+		for line in f:
+			line = line.strip()
+			if line.startswith('begin '):
+				section = line[6:].split(':')[0].strip()
+				block = {}
+			elif line.startswith('end '):
+				if section == 'data':
+					data_blocks.append(block)
+				elif section == 'simulation':
+					sim_info = block
+				section = None
+				block = None
+			elif block is not None and ': ' in line:
+				key, value = line.split(': ', 1)
+				if key == 'Param':
+					block.setdefault('Param', {})
+					name, _, param_value = value.partition('=')
+					block['Param'][name.strip()] = param_value.strip()
+				else:
+					block[key] = value.strip()
+	return sim_info, data_blocks
+
+class McStasRun(Mapping):
+	def __init__(self, dirname, processes=None):
+		self.dirname = dirname
+		self.processes = processes
+		self.sim_info = {}
+		self.blocks = {}
+		self._aliases = {}
+		self._monitors = {}
+		self._futures = {}
+		self._pool = None
+
+		sim_file = os.path.join(dirname, 'mccode.sim')
+		if os.path.isfile(sim_file):
+			self.sim_info, data_blocks = readMcCodeSim(sim_file)
+		else:
+			# runs without mccode.sim: treat every .dat except mccode.dat as a monitor
+			data_blocks = [{'filename': os.path.basename(f)} for f in sorted(glob.glob(os.path.join(dirname, '*.dat')))
+							if os.path.basename(f) != 'mccode.dat']
+
+		for block in data_blocks:
+			if 'filename' not in block:
+				continue
+			name = os.path.splitext(block['filename'])[0]
+			self.blocks[name] = block
+			# also allow lookup by file name and component name
+			self._aliases[block['filename']] = name
+			if 'component' in block:
+				self._aliases.setdefault(block['component'], name)
+
+	@property
+	def parameters(self):
+		return self.sim_info.get('Param', {})
+
+	def key(self, name):
+		if name in self.blocks:
+			return name
+		return self._aliases[name]
+
+	def filename(self, name):
+		return os.path.join(self.dirname, self.blocks[self.key(name)]['filename'])
+
+	def __getitem__(self, name):
+		name = self.key(name)
+		if name not in self._monitors:
+			if name in self._futures:
+				self._monitors[name] = self._futures.pop(name).result()
+			else:
+				self._monitors[name] = mc.loadMcStasMonitor(self.filename(name))
+		return self._monitors[name]
+
+	def __iter__(self):
+		return iter(self.blocks)
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def __contains__(self, name):
+		return name in self.blocks or name in self._aliases
+
+	# Start parsing the given monitors (default: all) in worker processes.
+	# Monitors already loaded or with a valid cache entry are left to be
+	# memory-mapped on access, which is faster than a round trip to a worker
+	def prefetch(self, names=None):
+		if names is None:
+			names = list(self.blocks)
+		pending = []
+		for name in names:
+			name = self.key(name)
+			if name in self._monitors or name in self._futures:
+				continue
+			if mcstasCache.ENABLED and mcstasCache.is_cached(self.filename(name)):
+				continue
+			pending.append(name)
+
+		if len(pending) > 1:
+			if self._pool is None:
+				self._pool = ProcessPoolExecutor(self.processes)
+			for name in pending:
+				self._futures[name] = self._pool.submit(mc.loadMcStasMonitor, self.filename(name))
+		return self
+
+	def close(self):
+		if self._pool is not None:
+			self._pool.shutdown(cancel_futures=True)
+			self._pool = None
+		self._futures = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def __repr__(self):
+		return "McStasRun(%r, %d monitors)" % (self.dirname, len(self))
+
+# Load a list of monitor files in parallel, preserving order
+def loadMcStasMonitors(filenames, processes=None):
+	filenames = list(filenames)
+	if len(filenames) < 2:
+		return [mc.loadMcStasMonitor(f) for f in filenames]
+	with ProcessPoolExecutor(processes) as pool:
+		return list(pool.map(mc.loadMcStasMonitor, filenames))
@@ -0,0 +1,127 @@
+#!/bin/python3
+# Out-of-core streaming reader for large array_2d McStas monitors
+#
+# The I, I_err and N blocks are read a chunk of rows at a time, so reductions
+# only ever hold one chunk plus their (small) result in memory. The ROI and
+# projection reductions use the same pixel coordinates and error definitions
+# as count.py and display.py, so both paths give the same numbers.
+
+import re
+import numpy as np
+import mcstasHelper as mc
+from rebinHelper import rebin_array
+from roiHelper import pixel_coordinates
+
+I_BLOCK, SIGI_BLOCK, N_BLOCK = 0, 1, 2
+
+# Header dict, (ny, nx) and extent of an array_2d monitor, without reading its data
+def readStreamHeader(filename):
+	dataHeader = mc.parseMcStasHeader(mc.readMcStasHeader(filename))
+	if dataHeader['type'][:8] != "array_2d":
+		raise ValueError("Streaming is only supported for array_2d data: "+filename)
+	nx, ny = (int(v) for v in re.findall(r"\d+", dataHeader['type'][8:]))
+	extent = np.array(dataHeader['xylimits'].split(), dtype=float)
+	return dataHeader, (ny, nx), extent
+
+# Yield (block, first row, rows) for chunks of at most chunk_rows rows, where
+# block is I_BLOCK, SIGI_BLOCK or N_BLOCK and rows is a 2d array
+def iterMcStasBlocks(filename, chunk_rows=256):
+	block = -1
+	row = 0
+	in_data = False
+	rows = []
+	with open(filename, 'r') as f:
+		for r in f:
+			if (r[0]=="#"):
+				if rows:
+					yield block, row-len(rows), parse_rows(rows)
+					rows = []
+				in_data = False
+			elif r.strip():
+				# a data row after any '#' line starts the next block
+				if not in_data:
+					block += 1
+					row = 0
+					in_data = True
+				rows.append(r)
+				row += 1
+				if len(rows) == chunk_rows:
+					yield block, row-len(rows), parse_rows(rows)
+					rows = []
+		if rows:
+			yield block, row-len(rows), parse_rows(rows)
+
+def parse_rows(rows):
+	return np.fromstring(''.join(rows), sep=' ').reshape(len(rows), -1)
+
+# Sum of I within a square (x0, x1, y0, y1) or circular (x0, y0, radius) ROI,
+# with the error sqrt(sum(I^2)) reported by count.py. Without an ROI the
+# sum is empty, (0, 0)
+def roi_sum(filename, square=None, circle=None, chunk_rows=256):
+	if square is None and circle is None:
+		return 0., 0.
+	dataHeader, shape, extent = readStreamHeader(filename)
+	x, y = pixel_coordinates(shape, extent)
+
+	roi_sum = 0.
+	sum_sq = 0.
+	for block, row0, rows in iterMcStasBlocks(filename, chunk_rows):
+		if block != I_BLOCK:
+			break
+		yc = y[row0:row0+len(rows)]
+		if square is not None:
+			x0, x1, y0, y1 = square
+			mask = ((-y1 <= yc) & (yc < -y0))[:, np.newaxis] & ((x0 <= x) & (x < x1))[np.newaxis, :]
+		else:
+			x0, y0, radius = circle
+			mask = (x[np.newaxis, :] - x0) ** 2 + (yc[:, np.newaxis] - y0) ** 2 <= radius ** 2
+		roi_sum += np.sum(rows[mask])
+		sum_sq += np.sum(np.square(rows[mask]))
+	return roi_sum, np.sqrt(sum_sq)
+
+# X and Y cross-sections of I as shown by display.py, with errors added in
+# quadrature from I_err. Returns (x_profile, x_err, y_profile, y_err), where
+# y_profile is in row order (display.py flips it for plotting)
+def projections(filename, chunk_rows=256):
+	dataHeader, (ny, nx), extent = readStreamHeader(filename)
+	x_profile = np.zeros(nx)
+	x_err_sq = np.zeros(nx)
+	y_profile = np.zeros(ny)
+	y_err_sq = np.zeros(ny)
+	for block, row0, rows in iterMcStasBlocks(filename, chunk_rows):
+		if block == I_BLOCK:
+			x_profile += np.sum(rows, axis=0)
+			y_profile[row0:row0+len(rows)] = np.sum(rows, axis=1)
+		elif block == SIGI_BLOCK:
+			x_err_sq += np.sum(np.square(rows), axis=0)
+			y_err_sq[row0:row0+len(rows)] = np.sum(np.square(rows), axis=1)
+	return x_profile, np.sqrt(x_err_sq), y_profile, np.sqrt(y_err_sq)
+
+# Rebin I, I_err and N by integer factors (fy, fx): I and N are summed, I_err
+# is added in quadrature. Trailing rows/columns that do not fill a bin are
+# dropped. Returns (I, sigI, N, extent) of the rebinned image
+def rebin(filename, fy, fx, chunk_rows=256):
+	dataHeader, (ny, nx), extent = readStreamHeader(filename)
+	my, mx = ny // fy, nx // fx
+	out = np.zeros((3, my, mx))
+
+	# chunks must hold whole output rows
+	chunk_rows = max(fy, chunk_rows - chunk_rows % fy)
+	for block, row0, rows in iterMcStasBlocks(filename, chunk_rows):
+		# only rows belonging to complete output bins
+		start = -row0 % fy
+		stop = min(len(rows), my*fy - row0)
+		if stop <= start:
+			continue
+		part = rows[start:stop]
+		if block == SIGI_BLOCK:
+			# accumulate variances, the square root is taken at the end
+			part = np.square(part)
+		part = rebin_array(part, (fy, fx))
+		first = (row0 + start) // fy
+		out[block, first:first+len(part)] += part
+
+	out[SIGI_BLOCK] = np.sqrt(out[SIGI_BLOCK])
+	new_extent = np.array([extent[0], extent[0] + (extent[1]-extent[0]) * mx*fx/nx,
+						   extent[2], extent[2] + (extent[3]-extent[2]) * my*fy/ny])
+	return out[I_BLOCK], out[SIGI_BLOCK], out[N_BLOCK], new_extent
@@ -0,0 +1,214 @@
+#!/bin/python3
+# GP-SANS MNO event files to McStas-format detector images
+#
+# Python counterpart of analyze_GP-SANS/MNO_to_intensityPSD.cpp. The DetIDmap
+# is turned once into dense arrays indexed by detector ID, the event lines
+# ("gps_time, time, id, value") are parsed in blocks by np.loadtxt and
+# histogrammed with np.bincount. Large files are split into byte ranges that
+# are converted by a pool of worker processes:
+#
+#	detmap = readDetIDMap('DetIDmap.csv')
+#	N, info = histogramMNO('MNO_GPSANS_1234.dat', detmap)
+#	mon = mnoMonitor(N, duration, info['title'])	# McStasMonitor as from mcstasHelper
+#	writePSD('GPSANS_1234.npz', N, duration, info['title'])	# or .dat for McStas text
+#
+# Events outside the detector image are counted and dropped instead of being
+# written out of bounds.
+
+import os
+import io
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import mcstasHelper as mc
+
+# GP-SANS detector constants
+NUM_BINS_X = 196
+NUM_BINS_Y = 256
+XWIDTH = 0.52525*2 # [m]
+YWIDTH = 256*0.004086 # [m]
+XMIN, XMAX = -XWIDTH/2, XWIDTH/2
+YMIN, YMAX = -YWIDTH/2, YWIDTH/2
+# higher detector IDs are not GP-SANS detector tubes
+MAX_DET_ID = 195
+
+RUNNUM_PREFIX = "#MIRROR NEUTRON EVENT DATA - RUNNUM "
+TITLE_PREFIX = "#Title: "
+
+# Read DetIDmap.csv ("id, scaling, x, z" lines) into dense arrays indexed by
+# detector ID: found, scaling, x, z and the x bin of each tube (-1 if outside
+# the detector image)
+def readDetIDMap(filename):
+	rows = np.loadtxt(filename, delimiter=',', comments='#', ndmin=2)
+	ids = rows[:, 0].astype(int)
+	if np.any(ids < 0):
+		raise ValueError("Negative detector ID in "+filename)
+
+	size = max(MAX_DET_ID, ids.max(initial=0)) + 1
+	detmap = {'found': np.zeros(size, dtype=bool), 'scaling': np.zeros(size),
+			  'x': np.zeros(size), 'z': np.zeros(size)}
+	detmap['found'][ids] = True
+	for column, key in enumerate(('scaling', 'x', 'z'), 1):
+		detmap[key][ids] = rows[:, column]
+
+	xbin = np.floor((detmap['x'] - XMIN) / (XWIDTH / NUM_BINS_X)).astype(int)
+	detmap['xbin'] = np.where(detmap['found'] & (xbin >= 0) & (xbin < NUM_BINS_X), xbin, -1)
+	return detmap
+
+# Read the MNO header: the run number from the first line and the title from
+# the "#Title: " line, after which the event data starts. Returns
+# (run_num, title, byte offset of the data)
+def readMNOHeader(filename):
+	with open(filename, 'rb') as f:
+		first = f.readline().decode()
+		pos = first.find(RUNNUM_PREFIX)
+		if pos < 0:
+			raise ValueError("Not an MNO event file: "+filename)
+		run_num = int(first[pos+len(RUNNUM_PREFIX):])
+
+		title = ''
+		for line in iter(f.readline, b''):
+			line = line.decode()
+			if TITLE_PREFIX in line:
+				title = line[line.find(TITLE_PREFIX)+len(TITLE_PREFIX):].rstrip('\r\n')
+				break
+		return run_num, title, f.tell()
+
+# (id, value) columns of a block of event lines (bytes). Malformed lines are
+# reported and skipped
+def parseEvents(block):
+	try:
+		return np.loadtxt(io.BytesIO(block), delimiter=',', comments='#', usecols=(2, 3), dtype=np.int64, ndmin=2)
+	except ValueError:
+		rows = []
+		for line in block.decode().splitlines():
+			if not line.strip() or line[0] == '#':
+				continue
+			fields = line.split(',')
+			try:
+				rows.append((int(fields[2]), int(fields[3])))
+			except (IndexError, ValueError):
+				print("Error reading line: "+line)
+		return np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+# Add the events of one block to the flat N histogram. Returns the number of
+# events (missing from the DetIDmap, outside the detector image)
+def histogramEvents(N, events, detmap):
+	ids, values = events[:, 0], events[:, 1]
+	tubes = (ids >= 0) & (ids <= MAX_DET_ID)
+	ids, values = ids[tubes], values[tubes]
+
+	found = detmap['found'][ids]
+	missing = np.count_nonzero(~found)
+	ids, values = ids[found], values[found]
+
+	xbin = detmap['xbin'][ids]
+	ybin = np.floor((values * detmap['scaling'][ids] - YMIN) / (YWIDTH / NUM_BINS_Y)).astype(np.int64)
+	inside = (xbin >= 0) & (ybin >= 0) & (ybin < NUM_BINS_Y)
+	N += np.bincount(ybin[inside] * NUM_BINS_X + xbin[inside], minlength=N.size)
+	return missing, np.count_nonzero(~inside)
+
+# Histogram the event lines starting in the byte range [start, stop) of an
+# MNO file, reading about block_size bytes at a time. Returns the flat N
+# histogram and the (missing, out of range) event counts
+def histogramMNORange(filename, detmap, start, stop, block_size=1<<26):
+	N = np.zeros(NUM_BINS_Y*NUM_BINS_X, dtype=np.int64)
+	missing = out_of_range = 0
+	with open(filename, 'rb') as f:
+		# a line belongs to the range its first character is in
+		if start > 0:
+			f.seek(start-1)
+			f.readline()
+		while f.tell() < stop:
+			block = f.read(max(1, min(block_size, stop - f.tell())))
+			if not block:
+				break
+			if not block.endswith(b'\n'):
+				block += f.readline()
+			m, o = histogramEvents(N, parseEvents(block), detmap)
+			missing += m
+			out_of_range += o
+	return N, missing, out_of_range
+
+# N histogram (NUM_BINS_Y, NUM_BINS_X) of an MNO file. Files larger than
+# split_size are converted in byte ranges by a pool of processes (default:
+# all cores). Returns (N, info) with info holding run_num, title and the
+# numbers of events missing from the DetIDmap or outside the detector image
+def histogramMNO(filename, detmap, processes=None, split_size=1<<28):
+	if isinstance(detmap, str):
+		detmap = readDetIDMap(detmap)
+	run_num, title, start = readMNOHeader(filename)
+	stop = os.path.getsize(filename)
+
+	edges = list(range(start, stop, split_size)) + [stop]
+	if len(edges) <= 2 or processes == 1:
+		parts = [histogramMNORange(filename, detmap, start, stop)]
+	else:
+		with ProcessPoolExecutor(processes) as pool:
+			n = len(edges) - 1
+			parts = list(pool.map(histogramMNORange, [filename]*n, [detmap]*n, edges[:-1], edges[1:]))
+
+	N = sum(part[0] for part in parts).reshape(NUM_BINS_Y, NUM_BINS_X)
+	info = {'run_num': run_num, 'title': title,
+			'missing': int(sum(part[1] for part in parts)), 'out_of_range': int(sum(part[2] for part in parts))}
+	if info['missing']:
+		print("! DetIDmap information not found for", info['missing'], "events")
+	if info['out_of_range']:
+		print("! Ignoring", info['out_of_range'], "events outside the detector image")
+	return N, info
+
+# McStas header lines (without the leading '# ') of a GP-SANS image
+def psdHeader(title):
+	return ["Format: GP-SANS Data Summary with McStas format",
+			"Instrument: CG-2",
+			"type: array_2d(%d, %d)" % (NUM_BINS_X, NUM_BINS_Y),
+			"component: Histogram",
+			"position: 0 0 ?",
+			"title: "+title,
+			"xvar: X",
+			"yvar: Y",
+			"xlabel: X position [cm]",
+			"ylabel: Y position [cm]",
+			"zvar: N",
+			"xylimits: %g %g %g %g" % (100*XMIN, 100*XMAX, 100*YMIN, 100*YMAX)]
+
+# I, I_err and N blocks of an N histogram measured for duration seconds
+def psdBlocks(N, duration):
+	N = np.asarray(N)
+	return N / duration, np.sqrt(N) / duration, N
+
+# McStasMonitor of an N histogram, usable by the ROI and display tools
+def mnoMonitor(N, duration, title='', filename=None):
+	return mc.McStasMonitor(filename, psdHeader(title), np.vstack(psdBlocks(N, duration)).astype(float))
+
+# Write an N histogram as a McStas text monitor, as MNO_to_intensityPSD.cpp does
+def writeMcStasPSD(outFile, N, duration, title=''):
+	I, sigI, N = psdBlocks(N, duration)
+	with open(outFile, 'w') as f:
+		f.write(''.join('# '+line+'\n' for line in psdHeader(title)))
+		f.write("# Data [] I:\n")
+		np.savetxt(f, I, fmt='%g ', delimiter='')
+		f.write("# Errors [] I_err:\n")
+		np.savetxt(f, sigI, fmt='%g ', delimiter='')
+		f.write("# Events [] N:\n")
+		np.savetxt(f, N, fmt='%d ', delimiter='')
+
+# Write an N histogram as a .npz monitor (header and stacked I, I_err, N),
+# or as McStas text for any other extension
+def writePSD(outFile, N, duration, title=''):
+	if outFile.endswith('.npz'):
+		mc.writeMcStasNPZ(outFile, mnoMonitor(N, duration, title))
+	else:
+		writeMcStasPSD(outFile, N, duration, title)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert an MNO_GPSANS event file to a McStas-compatible PSD image.')
+	parser.add_argument('inFile', help='Input file, MNO_GPSANS_######.dat')
+	parser.add_argument('detIDmap', help='DetIDmap.csv')
+	parser.add_argument('outFile', help='Output McStas monitor file, .npz for the binary format')
+	parser.add_argument('duration', type=float, help='Duration of run [s] found with ONCAT summary')
+	parser.add_argument('--processes', type=int, help='number of worker processes (default: all cores)')
+	args = parser.parse_args()
+
+	N, info = histogramMNO(args.inFile, args.detIDmap, args.processes)
+	writePSD(args.outFile, N, args.duration, info['title'])
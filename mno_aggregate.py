@@ -0,0 +1,128 @@
+#!/bin/python3
+# Sum the MNO_GPSANS segments of one measurement into one GP-SANS image
+#
+# Each segment is histogrammed with mnoHelper in steps of checkpoint_bytes.
+# After every step the summed N histogram and the progress of every segment
+# (byte offset, duration, event counts) are saved to a .npz checkpoint.
+# Running again with the same checkpoint skips finished segments and resumes
+# an interrupted one from its last offset, so adding a segment only reads
+# that segment. I and I_err are normalized by the summed segment durations:
+#
+#	aggregator = MNOAggregator('GPSANS_1234.npz', 'DetIDmap.csv')
+#	aggregator.add('MNO_GPSANS_1234_1.dat', 600)
+#	aggregator.add('MNO_GPSANS_1234_2.dat', 580)
+#	mon = aggregator.monitor()
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import mnoHelper as mh
+from mcstasCache import cache_key
+
+DETMAP_KEYS = ('found', 'scaling', 'x')
+
+class MNOAggregator:
+	def __init__(self, checkpoint, detIDmap, checkpoint_bytes=1<<28):
+		self.checkpoint = checkpoint
+		self.detmap = mh.readDetIDMap(detIDmap)
+		self.checkpoint_bytes = checkpoint_bytes
+		self.N = np.zeros((mh.NUM_BINS_Y, mh.NUM_BINS_X), dtype=np.int64)
+		self.segments = []
+		if os.path.isfile(checkpoint):
+			self.load()
+
+	def load(self):
+		with np.load(self.checkpoint, allow_pickle=False) as f:
+			for key in DETMAP_KEYS:
+				if not np.array_equal(f['detmap_'+key], self.detmap[key]):
+					raise ValueError(self.checkpoint+" was made with a different DetIDmap")
+			self.N = f['N']
+			self.segments = json.loads(str(f['segments']))
+
+	# Write N and the segment records together, replacing the previous
+	# checkpoint only once the new one is complete
+	def save(self):
+		tmp = self.checkpoint+'.%d.tmp' % os.getpid()
+		with open(tmp, 'wb') as f:
+			np.savez(f, N=self.N, segments=json.dumps(self.segments),
+					 **{'detmap_'+key: self.detmap[key] for key in DETMAP_KEYS})
+		os.replace(tmp, self.checkpoint)
+
+	def find(self, filename):
+		path = os.path.abspath(filename)
+		for segment in self.segments:
+			if segment['key']['path'] == path:
+				return segment
+		return None
+
+	# Add the events of one MNO segment measured for duration seconds (None
+	# keeps the duration of a segment added before). Returns its record
+	def add(self, filename, duration=None):
+		key = cache_key(filename)
+		segment = self.find(filename)
+		if segment is None:
+			if duration is None:
+				raise ValueError("No duration given for "+filename)
+			run_num, title, start = mh.readMNOHeader(filename)
+			segment = {'key': key, 'duration': duration, 'run_num': run_num, 'title': title,
+					   'offset': start, 'stop': key['size'], 'events': 0, 'missing': 0, 'out_of_range': 0}
+			self.segments.append(segment)
+		elif segment['key'] != key:
+			raise ValueError(filename+" changed since it was added to "+self.checkpoint)
+		elif duration is not None:
+			segment['duration'] = duration
+
+		while segment['offset'] < segment['stop']:
+			stop = min(segment['offset'] + self.checkpoint_bytes, segment['stop'])
+			N, missing, out_of_range = mh.histogramMNORange(filename, self.detmap, segment['offset'], stop)
+			self.N += N.reshape(self.N.shape)
+			segment['events'] += int(N.sum())
+			segment['missing'] += int(missing)
+			segment['out_of_range'] += int(out_of_range)
+			segment['offset'] = stop
+			self.save()
+		self.save()
+		return segment
+
+	@property
+	def duration(self):
+		return sum(segment['duration'] for segment in self.segments)
+
+	@property
+	def complete(self):
+		return all(segment['offset'] >= segment['stop'] for segment in self.segments)
+
+	@property
+	def title(self):
+		return self.segments[0]['title'] if self.segments else ''
+
+	# McStasMonitor of the summed image
+	def monitor(self):
+		return mh.mnoMonitor(self.N, self.duration, self.title, self.checkpoint)
+
+	def write(self, outFile):
+		mh.writePSD(outFile, self.N, self.duration, self.title)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Sum MNO_GPSANS segments into a McStas-compatible PSD image, with checkpoints.')
+	parser.add_argument('checkpoint', help='.npz checkpoint, created or resumed')
+	parser.add_argument('detIDmap', help='DetIDmap.csv')
+	parser.add_argument('--segment', nargs=2, action='append', metavar=('inFile', 'duration'),
+						help='MNO segment and its duration [s] (can be repeated)')
+	parser.add_argument('--out', type=str, help='write the summed image as a McStas monitor file (.npz for the binary format)')
+	parser.add_argument('--checkpoint_bytes', type=int, default=1<<28, help='bytes read between checkpoints')
+	args = parser.parse_args()
+
+	aggregator = MNOAggregator(args.checkpoint, args.detIDmap, args.checkpoint_bytes)
+	for inFile, duration in args.segment or []:
+		segment = aggregator.add(inFile, float(duration))
+		print(f"{inFile}: {segment['events']} events in {segment['duration']} s", file=sys.stderr)
+		for key, message in (('missing', 'missing from the DetIDmap'), ('out_of_range', 'outside the detector image')):
+			if segment[key]:
+				print("!", segment[key], "events", message, file=sys.stderr)
+
+	print(f"{len(aggregator.segments)} segments, {int(aggregator.N.sum())} events in {aggregator.duration} s")
+	if args.out:
+		aggregator.write(args.out)
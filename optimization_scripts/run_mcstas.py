@@ -1,20 +1,129 @@
 import hashlib
+import json
+import shutil
+import subprocess
+import threading
 import csv
 import os
 import numpy as np
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# for unique naming of output files
+# reduction tools (mcstasHelper, mcstasRun) live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mcstasRun import McStasRun
+
+# fixed mcrun settings of every simulation
+INSTRUMENT = 'SANS1.instr'
+SEED = 100100100
+FIXED_PARAMS = {'Wavelength_Min': 0, 'Wavelength_Max': 20, 'VS_Central_Wavelength': 0, 'Channel': 2}
+# monitors a run must contain to be reused
+REQUIRED_FILES = ['mccode.sim', 'Sample_Position_spectrum.dat']
+# MPI ranks shared by the simulations of one objective_function call
+MPI_CORES = int(os.environ.get('MCSTAS_MPI_CORES', 32))
+
+_index_lock = threading.Lock()
+_key_locks = {}
+# output_dir -> records of its index and the bytes of the index file read so far
+_indexes = {}
+_compile_lock = threading.Lock()
+_compiled = set()
+
+# legacy naming of output files, from str() of the parameters
 def generate_hash(*parameters):
 	combined_parameters = ''.join(str(param) for param in parameters)
 	hash_object = hashlib.sha256(combined_parameters.encode())
 	hash_value = hash_object.hexdigest()
 	return hash_value
 
-# run simulation with params
-def run(n, coll, apt_rad, R, output_dir):
+# Content address of a simulation: SHA-256 of a canonical JSON encoding of
+# the values passed to mcrun (str(ndarray) depends on print options and
+# drops digits). The number of MPI ranks is not part of the key, runs with
+# the same ncount split differently are statistically equivalent.
+# Returns (key, parameters)
+def simulation_key(n, coll, apt_rad, R):
+	params = dict(FIXED_PARAMS, instrument=INSTRUMENT, seed=SEED, ncount=float(n), N=float(coll),
+				  Exit_slit_radius=float("{:0.4f}".format(apt_rad)), R=np.asarray(R, dtype=float).tolist())
+	encoded = json.dumps(params, sort_keys=True, separators=(',', ':'))
+	return hashlib.sha256(encoded.encode()).hexdigest(), params
+
+# an mcrun output directory that finished and holds the monitors analyze reads
+def is_complete(dirName):
+	paths = [os.path.join(dirName, name) for name in REQUIRED_FILES]
+	return all(os.path.isfile(path) and os.path.getsize(path) > 0 for path in paths)
+
+# Index of finished simulations in output_dir, one JSON record per line
+# with the key, run directory, parameters and analyzed result
+def index_file(output_dir):
+	return "{}simulations.jsonl".format(output_dir)
+
+# Records of the index of output_dir by key. The index is kept in memory and
+# only the lines appended since the last call (e.g. by another process) are
+# parsed, so lookups do not slow down as the index grows
+def load_index(output_dir):
+	with _index_lock:
+		index = _indexes.setdefault(output_dir, {'offset': 0, 'records': {}})
+		try:
+			with open(index_file(output_dir), 'rb') as f:
+				if os.fstat(f.fileno()).st_size < index['offset']:
+					# index file was replaced, read it again
+					index['offset'], index['records'] = 0, {}
+				f.seek(index['offset'])
+				data = f.read()
+		except FileNotFoundError:
+			return index['records']
+
+		# a partly written last line is read next time
+		data = data[:data.rfind(b'\n')+1]
+		index['offset'] += len(data)
+		for line in data.decode().splitlines():
+			try:
+				record = json.loads(line)
+			except ValueError:
+				continue # damaged line
+			index['records'][record['key']] = record
+		return index['records']
+
+def record_simulation(output_dir, record):
+	records = load_index(output_dir)
+	with _index_lock:
+		with open(index_file(output_dir), 'a') as f:
+			f.write(json.dumps(record, sort_keys=True)+'\n')
+		records[record['key']] = record
+
+# one lock per simulation key, so concurrent evaluations of the same
+# configuration in this process run it once
+def key_lock(key):
+	with _index_lock:
+		return _key_locks.setdefault(key, threading.Lock())
+
+# Compile the instrument with the --mpi setting of the runs once before they
+# are launched concurrently, so parallel mcrun calls do not rebuild it at
+# the same time
+def compile_instrument(mpi):
+	with _compile_lock:
+		if mpi not in _compiled:
+			command = "mcrun -c --mpi={} --info {}".format(mpi, INSTRUMENT)
+			status = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL).returncode
+			if status != 0:
+				raise RuntimeError("compiling {} failed (status {}): {}".format(INSTRUMENT, status, command))
+			_compiled.add(mpi)
+
+# run simulation with params on mpi ranks (default MPI_CORES), or return the
+# directory of a complete earlier run with the same parameters. With log the
+# mcrun output goes to mcrun.log in the run directory instead of the terminal
+def run(n, coll, apt_rad, R, output_dir, mpi=None, log=False):
 	# const params: coll, apt_rad
 	# var params: R 
 
+	key, _ = simulation_key(n, coll, apt_rad, R)
+	filename = "{}run_{}".format(output_dir, key)
+	legacy = "{}run_{}".format(output_dir, generate_hash(n, coll, apt_rad, R))
+	for dirName in (filename, legacy):
+		if is_complete(dirName):
+			print("reusing simulation:", dirName)
+			return dirName
+
 	# generate parameter string for R
 	params_string = ""
 	print(R)
@@ -26,21 +135,40 @@ def run(n, coll, apt_rad, R, output_dir):
 			#params_string += #f"{param_name}=R[{i},{j}] "
 
 	params_string = params_string.rstrip()
-	hash_value = generate_hash(n, coll, apt_rad, R)
+	fixed_string = ' '.join("{}={}".format(name, value) for name, value in FIXED_PARAMS.items())
 
-	filename = "{}run_{}".format(output_dir, hash_value)
-	print("running command:\nmcrun --mpi=32 SANS1.instr -d {} -s 100100100 -n {} Wavelength_Min=0 Wavelength_Max=20 VS_Central_Wavelength=0 Channel=2 N={} Exit_slit_radius={:0.4f} {}".format(filename, n, coll, apt_rad, params_string))
-	os.system("mcrun --mpi=32 SANS1.instr -d {} -s 100100100 -n {} Wavelength_Min=0 Wavelength_Max=20 VS_Central_Wavelength=0 Channel=2 N={} Exit_slit_radius={:0.4f} {}".format(filename, n, coll, apt_rad, params_string))
+	# mcrun writes to a temporary directory that is renamed once complete,
+	# so an interrupted run is never mistaken for a finished one
+	tmp = "{}.tmp{}".format(filename, os.getpid())
+	shutil.rmtree(tmp, ignore_errors=True)
+	command = "mcrun --mpi={} {} -d {} -s {} -n {} {} N={} Exit_slit_radius={:0.4f} {}".format(mpi or MPI_CORES, INSTRUMENT, tmp, SEED, n, fixed_string, coll, apt_rad, params_string)
+	print("running command:\n"+command)
+	log_file = filename+'.log'
+	if log:
+		with open(log_file, 'w') as f:
+			status = subprocess.run(command, shell=True, stdout=f, stderr=subprocess.STDOUT).returncode
+	else:
+		status = subprocess.run(command, shell=True).returncode
+	if status != 0 or not is_complete(tmp):
+		raise RuntimeError("mcrun failed for {} (status {}{})".format(tmp, status, ", see "+log_file if log else ""))
+	if log:
+		os.replace(log_file, os.path.join(tmp, 'mcrun.log'))
+
+	# remove an incomplete directory left by an earlier interrupted run
+	if os.path.isdir(filename):
+		print("replacing incomplete simulation:", filename)
+		shutil.rmtree(filename)
+	os.replace(tmp, filename)
 	return filename
 
 # analyze simulation output
 # return estimated countrate corrected for detector efficiency
 def analyze(dirName):
-	# Load data from dirName/Sample_Position_spectrum.dat
-	sim_dat = np.loadtxt("{}/Sample_Position_spectrum.dat".format(dirName))
-	L_sim = sim_dat[:,0] # [AA]
-	I_sim = sim_dat[:,1] # range 0..20AA, binsize=0.05AA, *20 to normalize to [n/s/0.05AA]
-	I_sim_err = sim_dat[:,2] # [n/s/0.05AA]
+	# Load data from dirName/Sample_Position_spectrum.dat, other monitors in the run are not parsed
+	sim_dat = McStasRun(dirName)['Sample_Position_spectrum']
+	L_sim = sim_dat.L # [AA]
+	I_sim = sim_dat.I # range 0..20AA, binsize=0.05AA, *20 to normalize to [n/s/0.05AA]
+	I_sim_err = sim_dat.sigI # [n/s/0.05AA]
 
 	# Scale data based on wavelength detector efficiency to find est. cps
 	I_mes = I_sim*L_sim/(1.8e5)
@@ -52,6 +180,35 @@ def analyze(dirName):
 
 	return sim_sum, sim_err
 
+# Recorded (sim_sum, sim_err) of a configuration whose run is still
+# complete, or None. index is the result of load_index when looking up
+# several configurations
+def cached_simulation(n, coll, apt_rad, R, output_dir, index=None):
+	key, _ = simulation_key(n, coll, apt_rad, R)
+	if index is None:
+		index = load_index(output_dir)
+	record = index.get(key)
+	if record is not None and is_complete(record['dir']):
+		return record['sim_sum'], record['sim_err']
+	return None
+
+# Simulated count rate (sim_sum, sim_err) of one configuration. Results are
+# recorded in the index of output_dir, so evaluating the same configuration
+# again neither runs McStas nor parses its output. mpi and log as for run
+def simulate(n, coll, apt_rad, R, output_dir, mpi=None, log=False):
+	key, params = simulation_key(n, coll, apt_rad, R)
+	with key_lock(key):
+		result = cached_simulation(n, coll, apt_rad, R, output_dir)
+		if result is not None:
+			print("reusing simulation for N={} Exit_slit_radius={}".format(coll, apt_rad))
+			return result
+
+		outDir = run(n, coll, apt_rad, R, output_dir, mpi, log)
+		sim_sum, sim_err = analyze(outDir)
+		record_simulation(output_dir, {'key': key, 'dir': outDir, 'params': params,
+									   'sim_sum': float(sim_sum), 'sim_err': float(sim_err)})
+		return sim_sum, sim_err
+
 # find mes_sum, mes_err for experiment with given const params
 def experiment_data(coll, apt_rad):
 	# Collimators, ap_radius, mes_sum, mes_err
@@ -70,31 +227,51 @@ def experiment_data(coll, apt_rad):
 	raise ValueError(f"No data available for coll={coll} and apt_rad={apt_rad}")
 
 
-def objective_function(n, coll_values, apt_rad_values, R, output_dir, summary_file):
-	err = 0 
+# Sum of squared differences between measured and simulated count rates over
+# all (coll, apt_rad) configurations. The configurations that still need a
+# simulation run concurrently, at most max_concurrent at a time (default:
+# all), sharing cores MPI ranks (default MPI_CORES): four new configurations
+# on 32 cores run as 4 x 8 ranks instead of 1 x 32 four times
+def objective_function(n, coll_values, apt_rad_values, R, output_dir, summary_file, cores=None, max_concurrent=None):
+	configurations = [(coll, apt_rad) for coll in coll_values for apt_rad in apt_rad_values]
 
-	for coll in coll_values:
-		for apt_rad in apt_rad_values:
-			# find measured intensity for given const params
-			mes_sum, mes_err = experiment_data(coll, apt_rad) 
+	# find measured intensity for given const params
+	measured = {configuration: experiment_data(*configuration) for configuration in configurations}
 
-			# run simulation with given const and var params
-			outDir = run(n, coll, apt_rad, R, output_dir)
-				
-			# extract simulation estimated count rate
-			sim_sum, sim_err = analyze(outDir)
-				
-			# write output to file
+	# split the cores over the simulations that actually run
+	index = load_index(output_dir)
+	pending = [c for c in dict.fromkeys(configurations) if cached_simulation(n, *c, R, output_dir, index) is None]
+	workers = max(1, min(len(pending), max_concurrent or len(pending)))
+	mpi = max(1, (cores or MPI_CORES) // workers)
+	if workers > 1:
+		compile_instrument(mpi)
+
+	# run simulations with given const and var params (or reuse earlier ones)
+	simulated = {}
+	with ThreadPoolExecutor(workers) as pool:
+		futures = {pool.submit(simulate, n, coll, apt_rad, R, output_dir, mpi, workers > 1): (coll, apt_rad)
+				   for coll, apt_rad in dict.fromkeys(configurations)}
+		for future in as_completed(futures):
+			simulated[futures[future]] = future.result()
+
+	# write output to file, in configuration order whatever order the
+	# simulations finished in
+	with open(summary_file, 'a', newline='') as file:
+		writer = csv.writer(file)
+		for coll, apt_rad in dict.fromkeys(configurations):
+			sim_sum, sim_err = simulated[coll, apt_rad]
 			line = [coll, apt_rad]
 			for i in range(R.shape[0]):
 				for j in range(R.shape[1]):
 					line.append(R[i, j]) 
 			line.extend([sim_sum, sim_err])
-			with open(summary_file, 'a', newline='') as file:
-				writer = csv.writer(file)
-				writer.writerow(line)
-					
-			err += (mes_sum - sim_sum)**2 
-			#err += (mes_sum/sim_sum - 1 )**2
+			writer.writerow(line)
+
+	err = 0 
+	for configuration in configurations:
+		mes_sum, mes_err = measured[configuration]
+		sim_sum, sim_err = simulated[configuration]
+		err += (mes_sum - sim_sum)**2 
+		#err += (mes_sum/sim_sum - 1 )**2
 				
-	return err 
+	return err
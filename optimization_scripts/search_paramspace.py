@@ -5,56 +5,10 @@
 import numpy as np
 import time
 import csv
-import os
-import hashlib
 import argparse
 
-# for unique naming of output files
-def generate_hash(*parameters):
-	combined_parameters = ''.join(str(param) for param in parameters)
-	hash_object = hashlib.sha256(combined_parameters.encode())
-	hash_value = hash_object.hexdigest()
-	return hash_value
-
-# run simulation with params
-def run(n, coll, apt_rad, R, output_dir):
-	# const params: coll, apt_rad
-	# var params: R 
-	
-	# generate parameter string for R
-	params_string = "" 
-	for i in range(R.shape[0]):
-		for j in range(R.shape[1]):
-			param_name = f"{['R0_', 'alpha_', 'm_'][j]}{i+1}"
-			param_value = R[i, j]
-			params_string += f"{param_name}={param_value} "
-			#params_string += #f"{param_name}=R[{i},{j}] "
-
-	params_string = params_string.rstrip()
-	hash_value = generate_hash(n, coll, apt_rad, R)
-
-	filename = "{}run_{}".format(output_dir, hash_value)
-	print("running command:\nmcrun --mpi=32 SANS1.instr -d {} -s 100100100 -n {} Wavelength_Min=0 Wavelength_Max=20 VS_Central_Wavelength=0 Channel=2 N={} Exit_slit_radius={:0.4f} {}".format(filename, n, coll, apt_rad, params_string))
-	os.system("mcrun --mpi=32 SANS1.instr -d {} -s 100100100 -n {} Wavelength_Min=0 Wavelength_Max=20 VS_Central_Wavelength=0 Channel=2 N={} Exit_slit_radius={:0.4f} {}".format(filename, n, coll, apt_rad, params_string))
-	return filename
-
-# analyze simulation output
-def analyze(dirName):
-	# Load data from dirName/Sample_Position_spectrum.dat
-	sim_dat = np.loadtxt("{}/Sample_Position_spectrum.dat".format(dirName))
-	L_sim = sim_dat[:,0] # [AA]
-	I_sim = sim_dat[:,1] # range 0..20AA, binsize=0.05AA, *20 to normalize to [n/s/0.05AA]
-	I_sim_err = sim_dat[:,2] # [n/s/0.05AA]
-
-	# Scale data based on wavelength detector efficiency to find est. cps
-	I_mes = I_sim*L_sim/(1.8e5)
-	I_mes_err = I_sim_err*L_sim/(1.8e5)
-
-	# Find total counts
-	sim_sum = np.sum(I_mes)
-	sim_err = np.sqrt(np.sum(np.square(I_mes_err)))
-	
-	return sim_sum, sim_err 
+# simulations are run, cached and analyzed as in the optimizer
+from run_mcstas import simulate
 
 def main(output_dir, num_samples):
 	# Step 0: Open summary file for writing results
@@ -130,11 +84,9 @@ def main(output_dir, num_samples):
 						print(k)
 						print(R_scaled)
 	
-						# run simulation with given const and var params
-						outDir = run(n, coll, ap_radius, R_scaled, output_dir)
-					
-						# extract simulation estimated count rate
-						sim_sum, sim_err = analyze(outDir)
+						# run simulation with given const and var params (or reuse an
+						# earlier one) and extract simulation estimated count rate
+						sim_sum, sim_err = simulate(n, coll, ap_radius, R_scaled, output_dir)
 				
 						# write output to file
 						line = [coll, ap_radius]
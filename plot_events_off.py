@@ -2,6 +2,7 @@ import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+from mcstasEvents import loadEvents
 
 def plot_off_mesh(filename):
 	with open(filename, "r") as f:
@@ -33,8 +34,10 @@ def plot_off_mesh(filename):
 	return ax
 
 def plot_3d_data(filename, ax):
-	data = np.loadtxt(filename, usecols=(0, 1, 2))
-	ax.scatter(data[:, 0], data[:, 2], data[:, 1], c="b", marker="o")
+	# converted to binary once, then memory-mapped on later runs
+	events = loadEvents(filename)
+	x, y, z = events.dtype.names[:3]
+	ax.scatter(events[x], events[z], events[y], c="b", marker="o")
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Plot .off geometry and 3D data on top")
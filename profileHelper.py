@@ -0,0 +1,96 @@
+#!/bin/python3
+# Beam profile metrics of x and y projections of 2d monitors
+#
+# Metrics are computed from moments and interpolated crossings with NumPy,
+# vectorized over a stack of profiles, so no fit is needed and flat-topped
+# guide profiles are handled the same as peaked ones. All moments weight the
+# bins by their summed intensity, as count.py does, so they agree on coarse
+# or non-uniform grids:
+#	centroid	intensity-weighted mean position, sum(y x)/sum(y)
+#	rms			sqrt(sum(y x^2)/sum(y)), the RMS about 0 reported by display.py
+#	sigma		RMS about the centroid
+#	fwhm		distance between the half-maximum crossings (left, right)
+#	w10, w90	positions where the cumulative intensity reaches 10% and 90%,
+#				width_10_90 = w90 - w10
+# A Gaussian fit is available separately (fit_gaussian).
+
+import numpy as np
+import mcstasHelper as mc
+from spectrumHelper import half_max_crossings
+
+# Position where the cumulative sum of each row first reaches fraction q,
+# interpolated linearly between bins
+def cumulative_position(x, cumulative, q):
+	rows = np.arange(cumulative.shape[0])
+	k = np.argmax(cumulative >= q, axis=1)
+	k0 = np.maximum(k - 1, 0)
+	c0, c1 = cumulative[rows, k0], cumulative[rows, k]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = np.where((k > 0) & (c1 != c0), (q - c0) / (c1 - c0), 1)
+	return x[rows, k0] + t * (x[rows, k] - x[rows, k0])
+
+# Metrics of profiles y (m,) or (n, m) at positions x (m,) or (n, m), with x
+# ascending. Returns a dict of length-n arrays (see above) plus total
+def profile_metrics(x, y):
+	y = np.atleast_2d(np.asarray(y, dtype=float))
+	x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+
+	total = np.sum(y, axis=1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		centroid = np.sum(x * y, axis=1) / total
+		sigma = np.sqrt(np.sum(np.square(x - centroid[:, np.newaxis]) * y, axis=1) / total)
+		rms = np.sqrt(np.sum(y * x**2, axis=1) / total)
+		cumulative = np.cumsum(y, axis=1) / total[:, np.newaxis]
+
+	left, right = half_max_crossings(x, y, np.argmax(y, axis=1))
+	w10 = cumulative_position(x, cumulative, 0.1)
+	w90 = cumulative_position(x, cumulative, 0.9)
+	return {'total': total, 'centroid': centroid, 'rms': rms, 'sigma': sigma,
+			'fwhm': right - left, 'left': left, 'right': right,
+			'w10': w10, 'w90': w90, 'width_10_90': w90 - w10}
+
+# X and Y projections of a 2d monitor as (x, x_profile, y, y_profile), with
+# ascending coordinates spanning the extent as in display.py
+def projections(mon):
+	extent = mon.extent
+	ny, nx = mon.shape
+	x = np.linspace(extent[0], extent[1], nx)
+	y = np.linspace(extent[2], extent[3], ny)
+	return x, np.sum(mon.I, axis=0), y, np.sum(mon.I, axis=1)
+
+# Metrics of the x and y projections of many 2d monitors (McStasMonitors or
+# filenames). Returns {'x': metrics, 'y': metrics, 'filename': [...]} with
+# metrics as from profile_metrics, in input order
+def monitor_metrics(monitors):
+	monitors = [mc.loadMcStasMonitor(mon) if isinstance(mon, str) else mon for mon in monitors]
+
+	# monitors with the same shape and extent share coordinates and are stacked
+	groups = {}
+	for i, mon in enumerate(monitors):
+		if mon.ndim != 2:
+			raise ValueError("Not 2d data: "+str(mon.filename))
+		groups.setdefault((mon.shape, tuple(mon.extent)), []).append(i)
+
+	result = {'x': {}, 'y': {}}
+	for members in groups.values():
+		x, _, y, _ = projections(monitors[members[0]])
+		stack = np.stack([monitors[i].I for i in members])
+		for axis, coords, profiles in (('x', x, np.sum(stack, axis=1)), ('y', y, np.sum(stack, axis=2))):
+			for key, values in profile_metrics(coords, profiles).items():
+				if key not in result[axis]:
+					result[axis][key] = np.empty(len(monitors))
+				result[axis][key][members] = values
+	result['filename'] = [mon.filename for mon in monitors]
+	return result
+
+def gaussian_function(x, amplitude, mean, std_dev):
+	return amplitude * np.exp(-(x - mean)**2 / (2 * std_dev**2))
+
+# Optional least-squares Gaussian fit of one profile, returns
+# (amplitude, mean, std_dev, fwhm)
+def fit_gaussian(x, y):
+	from scipy.optimize import curve_fit
+	initial_guess = [np.max(y), np.mean(x), np.std(x)]
+	params, _ = curve_fit(gaussian_function, x, y, p0=initial_guess)
+	amplitude, mean, std_dev = params
+	return amplitude, mean, std_dev, 2 * np.sqrt(2 * np.log(2)) * abs(std_dev)
@@ -0,0 +1,192 @@
+#!/bin/python3
+# Time-window index of monitor count rates for NeXus runs
+#
+# monitor2/event_index already holds the cumulative number of events at the
+# start of every pulse, so (event_time_zero, event_index) is an index of
+# cumulative counts versus time. It is extracted once, streamed through
+# beamFOM.pulse_slices, to a .npy file next to the run (rebuilt when the run
+# changes) and memory-mapped afterwards. The counts and rate in any time
+# window then take two searchsorted lookups, without re-reading the run:
+#
+#	index = loadRateIndex('CG2_1234.nxs.h5')
+#	rate, err = index.rate(100, 200)
+#	edges = index.time_bins(1000)
+#	rates, errs = index.rate(edges[:-1], edges[1:])
+#	keep, mean, std = sigma_clip(rates, nsigma=3)
+#	blocks, block_rates, block_errs = index.blocks(edges)
+#
+# As in beamFOM.py the window [t0, t1) covers the pulses starting in it, and
+# the last pulse of a run (whose end time is unknown) is not counted.
+
+import os
+import json
+import argparse
+import numpy as np
+import h5py
+from mcstasCache import cache_key
+from beamFOM import pulse_slices
+
+INDEX_DTYPE = np.dtype([('time', np.float64), ('cumulative', np.uint64)])
+
+def index_paths(filename):
+	return filename+'.rate.npy', filename+'.rate.json'
+
+# Extract (event_time_zero, event_index) of a run to its .npy index file,
+# reading chunk-aligned slices. Returns the path of the index
+def buildRateIndex(filename, chunk_rows=1<<20):
+	npy_file, meta_file = index_paths(filename)
+	with h5py.File(filename, 'r') as f:
+		group = f['entry']
+		n = group["monitor2/event_index"].shape[0]
+		title = group["title"][0].decode("UTF-8")
+
+		tmp = npy_file+'.%d.tmp' % os.getpid()
+		index = np.lib.format.open_memmap(tmp, mode='w+', dtype=INDEX_DTYPE, shape=(n,))
+		start = 0
+		for t, cumulative in pulse_slices(group, chunk_rows):
+			# slices after the first repeat the previous pulse
+			t, cumulative = (t, cumulative) if start == 0 else (t[1:], cumulative[1:])
+			index['time'][start:start+len(t)] = t
+			index['cumulative'][start:start+len(t)] = cumulative
+			start += len(t)
+		index.flush()
+		del index
+	os.replace(tmp, npy_file)
+
+	with open(meta_file, 'w') as f:
+		json.dump({'key': cache_key(filename), 'title': title}, f)
+	return npy_file
+
+# RateIndex of a run, building or rebuilding its index file if needed
+def loadRateIndex(filename):
+	npy_file, meta_file = index_paths(filename)
+	try:
+		with open(meta_file, 'r') as f:
+			meta = json.load(f)
+		valid = meta['key'] == cache_key(filename)
+	except (OSError, ValueError, KeyError):
+		valid = False
+	if not valid or not os.path.isfile(npy_file):
+		buildRateIndex(filename)
+		with open(meta_file, 'r') as f:
+			meta = json.load(f)
+	index = np.load(npy_file, mmap_mode='r')
+	return RateIndex(index['time'], index['cumulative'], meta.get('title', ''))
+
+class RateIndex:
+	def __init__(self, time, cumulative, title=''):
+		self.time = time
+		self.cumulative = cumulative
+		self.title = title
+
+	# time range covered by complete pulses
+	@property
+	def span(self):
+		return self.time[0], self.time[-1]
+
+	# Counts and duration of the pulses starting in [t0, t1) (scalars or arrays)
+	def counts(self, t0, t1):
+		a = np.searchsorted(self.time, t0, 'left')
+		b = np.searchsorted(self.time, t1, 'left')
+		# the last pulse has no end time
+		a = np.minimum(a, len(self.time)-1)
+		b = np.clip(b, a, len(self.time)-1)
+		counts = self.cumulative[b].astype(np.float64) - self.cumulative[a]
+		return counts, self.time[b] - self.time[a]
+
+	# Count rate and its Poisson error in [t0, t1) (scalars or arrays)
+	def rate(self, t0, t1):
+		counts, duration = self.counts(t0, t1)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return counts / duration, np.sqrt(counts) / duration
+
+	# n equal-width time bin edges spanning the run
+	def time_bins(self, n):
+		return np.linspace(*self.span, n+1)
+
+	# Variable-width segmentation of the rate: Bayesian blocks of the counts
+	# in the cells between edges (default 1000 equal-width bins). Returns
+	# (block edges, block rates, block errors)
+	def blocks(self, edges=None, p0=0.05):
+		if edges is None:
+			edges = self.time_bins(1000)
+		edges = np.asarray(edges, dtype=float)
+		counts, duration = self.counts(edges[:-1], edges[1:])
+		change_points = bayesian_blocks(edges, counts, p0)
+		block_edges = edges[change_points]
+		rates, errors = self.rate(block_edges[:-1], block_edges[1:])
+		return block_edges, rates, errors
+
+# Iterative n-sigma clipping: repeatedly drop values more than nsigma standard
+# deviations from the mean of the values kept so far, until nothing changes.
+# Returns (boolean mask of kept values, mean, std)
+def sigma_clip(values, nsigma=3, max_iter=10):
+	values = np.asarray(values, dtype=float)
+	keep = np.isfinite(values)
+	for i in range(max_iter):
+		mean = np.mean(values[keep])
+		std = np.std(values[keep])
+		new_keep = keep & (np.abs(values - mean) <= nsigma * std)
+		if np.array_equal(new_keep, keep):
+			break
+		keep = new_keep
+	return keep, np.mean(values[keep]), np.std(values[keep])
+
+# Optimal segmentation of binned Poisson counts (Scargle et al. 2013, ApJ 764,
+# 167) with the false-positive rate p0 for the prior on the number of blocks.
+# edges has one more entry than counts. Returns the indices into edges of the
+# block boundaries
+def bayesian_blocks(edges, counts, p0=0.05):
+	counts = np.asarray(counts, dtype=float)
+	n = len(counts)
+	ncp_prior = 4 - np.log(73.53 * p0 * n**-0.478)
+
+	best = np.zeros(n)
+	last = np.zeros(n, dtype=int)
+	for r in range(n):
+		# counts and width of the blocks (k..r) for every possible start k
+		block_counts = np.cumsum(counts[r::-1])[::-1]
+		width = edges[r+1] - edges[:r+1]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			fitness = np.where(block_counts > 0, block_counts * np.log(block_counts / width), 0)
+		fitness -= ncp_prior
+		fitness[1:] += best[:r]
+		last[r] = np.argmax(fitness)
+		best[r] = fitness[last[r]]
+
+	# walk back through the optimal partition
+	change_points = [n]
+	r = n
+	while r > 0:
+		r = last[r-1]
+		change_points.append(r)
+	return np.array(change_points[::-1])
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Count rates of a NeXus run over arbitrary time windows.')
+	parser.add_argument('inFile', help='Input file')
+	parser.add_argument('--window', nargs=2, type=float, action='append', metavar=('t0', 't1'),
+						help='print the count rate in [t0, t1) seconds (can be repeated)')
+	parser.add_argument('--bins', type=int, default=1000, help='number of equal-width time bins for --clip and --blocks')
+	parser.add_argument('--clip', type=float, metavar='n', help='iterative n-sigma clipping of the binned rates')
+	parser.add_argument('--blocks', action='store_true', help='print the Bayesian-blocks segmentation of the rate')
+	parser.add_argument('--p0', type=float, default=0.05, help='false-positive rate for --blocks')
+	args = parser.parse_args()
+
+	index = loadRateIndex(args.inFile)
+	print(index.title)
+
+	for t0, t1 in args.window or []:
+		rate, err = index.rate(t0, t1)
+		print(f"[{t0}, {t1}) s: {rate:.4e} ± {err:.2e} counts/ second")
+
+	edges = index.time_bins(args.bins)
+	if args.clip:
+		rates, errors = index.rate(edges[:-1], edges[1:])
+		keep, mean, std = sigma_clip(rates, args.clip)
+		print(f"{args.clip} sigma clipped: {mean:.4e} counts/ second, std {std:.2e}, {np.count_nonzero(~keep)} of {keep.size} bins removed")
+
+	if args.blocks:
+		block_edges, rates, errors = index.blocks(edges, args.p0)
+		for t0, t1, rate, err in zip(block_edges[:-1], block_edges[1:], rates, errors):
+			print(f"[{t0:.6g}, {t1:.6g}) s: {rate:.4e} ± {err:.2e} counts/ second")
@@ -0,0 +1,148 @@
+#!/bin/python3
+# Vectorized rebinning of 1d and 2d monitor data
+#
+# rebin_array/rebin_monitor combine groups of bins by integer factors (I and N
+# summed, I_err added in quadrature); regrid/regrid_monitor redistribute onto
+# an arbitrary target grid conserving the total intensity, assuming a uniform
+# distribution within each source bin.
+
+import numpy as np
+import mcstasHelper as mc
+
+# Combine groups of `factors` bins along each axis (an int applies to every
+# axis). how='sum' adds the values, 'quadrature' adds them in quadrature (for
+# errors) and 'mean' averages them. Trailing bins that do not fill a group
+# are dropped
+def rebin_array(a, factors, how='sum'):
+	a = np.asarray(a)
+	if np.ndim(factors) == 0:
+		factors = (int(factors),) * a.ndim
+	if len(factors) != a.ndim:
+		raise ValueError("Need one rebin factor per axis.")
+
+	trimmed = a[tuple(slice(0, (n // f) * f) for n, f in zip(a.shape, factors))]
+	if how == 'quadrature':
+		trimmed = np.square(trimmed)
+
+	# split each axis into (new bins, factor) and sum over the factor axes
+	grouped = trimmed.reshape([v for n, f in zip(trimmed.shape, factors) for v in (n // f, f)])
+	out = grouped.sum(axis=tuple(range(1, 2*a.ndim, 2)))
+
+	if how == 'quadrature':
+		return np.sqrt(out)
+	elif how == 'mean':
+		return out / np.prod(factors)
+	return out
+
+# Return a copy of the raw header lines with some values replaced
+def replace_header_values(raw, values):
+	new_raw = []
+	for line in raw:
+		key = line.split(": ")[0]
+		if key in values:
+			line = key+": "+values[key]
+		new_raw.append(line)
+	return new_raw
+
+# Rebin a McStasMonitor by integer factors, returning a new McStasMonitor with
+# type, extent and bin sizes updated to match
+def rebin_monitor(mon, factors):
+	if mon.ndim == 2:
+		if np.ndim(factors) == 0:
+			factors = (factors, factors)
+		fy, fx = factors
+		I = rebin_array(mon.I, factors)
+		data = np.concatenate([I, rebin_array(mon.sigI, factors, 'quadrature'), rebin_array(mon.N, factors)])
+		ny, nx = mon.shape
+		my, mx = I.shape
+		xmin, xmax, ymin, ymax = mon.extent
+		extent = [xmin, xmin + (xmax-xmin)*mx*fx/nx, ymin, ymin + (ymax-ymin)*my*fy/ny]
+		raw = replace_header_values(mon.raw, {'type': "array_2d(%d, %d)" % (mx, my),
+												'xylimits': ' '.join('%.15g' % v for v in extent)})
+	else:
+		f = int(np.ravel(factors)[0])
+		L = rebin_array(mon.L, f, 'mean')
+		data = np.column_stack([L, rebin_array(mon.I, f), rebin_array(mon.sigI, f, 'quadrature'), rebin_array(mon.N, f)])
+		n = mon.shape[0]
+		xmin, xmax = mon.extent
+		extent = [xmin, xmin + (xmax-xmin)*len(L)*f/n]
+		raw = replace_header_values(mon.raw, {'type': "array_1d(%d)" % len(L),
+												'xlimits': ' '.join('%.15g' % v for v in extent)})
+	return mc.McStasMonitor(mon.filename, raw, np.ascontiguousarray(data))
+
+# Sparse overlap weights between source and target bin edges: for each
+# target bin j (rows, sorted) and source bin i (cols), the fraction of source
+# bin i that falls inside target bin j
+def overlap_weights(old_edges, new_edges):
+	old_edges = np.asarray(old_edges, dtype=float)
+	new_edges = np.asarray(new_edges, dtype=float)
+	n_old = len(old_edges) - 1
+	lo, hi = new_edges[:-1], new_edges[1:]
+
+	# first and last source bin touching each target bin (at least one, so
+	# that every target bin has an entry, with weight 0 if outside the source)
+	first = np.clip(np.searchsorted(old_edges, lo, 'right') - 1, 0, n_old-1)
+	last = np.clip(np.searchsorted(old_edges, hi, 'left') - 1, 0, n_old-1)
+	last = np.maximum(first, last)
+	counts = last - first + 1
+
+	rows = np.repeat(np.arange(len(lo)), counts)
+	starts = np.cumsum(counts) - counts
+	cols = first[rows] + np.arange(rows.size) - starts[rows]
+
+	overlap = np.minimum(hi[rows], old_edges[cols+1]) - np.maximum(lo[rows], old_edges[cols])
+	weights = np.clip(overlap, 0, None) / np.diff(old_edges)[cols]
+	return starts, cols, weights
+
+# Apply overlap weights along one axis of a
+def apply_weights(a, axis, starts, cols, weights):
+	shape = [1] * a.ndim
+	shape[axis] = -1
+	contrib = np.take(a, cols, axis=axis) * weights.reshape(shape)
+	return np.add.reduceat(contrib, starts, axis=axis)
+
+# Conservatively redistribute a (1d or 2d) histogram with bin edges
+# old_edges (one array per axis) onto new_edges. Counts are shared in
+# proportion to the overlap of each source bin with each target bin, so the
+# total within the common range is preserved. If errors are given they are
+# propagated as independent uncertainties, and (values, errors) is returned
+def regrid(a, old_edges, new_edges, errors=None):
+	a = np.asarray(a, dtype=float)
+	if a.ndim == 1:
+		old_edges, new_edges = [old_edges], [new_edges]
+
+	var = None if errors is None else np.square(np.asarray(errors, dtype=float))
+	for axis in range(a.ndim):
+		starts, cols, weights = overlap_weights(old_edges[axis], new_edges[axis])
+		a = apply_weights(a, axis, starts, cols, weights)
+		if var is not None:
+			var = apply_weights(var, axis, starts, cols, np.square(weights))
+
+	if errors is None:
+		return a
+	return a, np.sqrt(var)
+
+# Regrid a McStasMonitor onto `shape` bins spanning the same extent (any, not
+# necessarily integer, ratio). Returns a new McStasMonitor
+def regrid_monitor(mon, shape):
+	if mon.ndim == 2:
+		my, mx = shape
+		ny, nx = mon.shape
+		xmin, xmax, ymin, ymax = mon.extent
+		old_edges = [np.linspace(ymin, ymax, ny+1), np.linspace(xmin, xmax, nx+1)]
+		new_edges = [np.linspace(ymin, ymax, my+1), np.linspace(xmin, xmax, mx+1)]
+		I, sigI = regrid(mon.I, old_edges, new_edges, mon.sigI)
+		N = regrid(mon.N, old_edges, new_edges)
+		data = np.concatenate([I, sigI, N])
+		raw = replace_header_values(mon.raw, {'type': "array_2d(%d, %d)" % (mx, my)})
+	else:
+		m = int(np.ravel(shape)[0])
+		xmin, xmax = mon.extent
+		old_edges = np.linspace(xmin, xmax, mon.shape[0]+1)
+		new_edges = np.linspace(xmin, xmax, m+1)
+		I, sigI = regrid(mon.I, old_edges, new_edges, mon.sigI)
+		N = regrid(mon.N, old_edges, new_edges)
+		L = (new_edges[:-1] + new_edges[1:]) / 2
+		data = np.column_stack([L, I, sigI, N])
+		raw = replace_header_values(mon.raw, {'type': "array_1d(%d)" % m})
+	return mc.McStasMonitor(mon.filename, raw, np.ascontiguousarray(data))
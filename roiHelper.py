@@ -0,0 +1,168 @@
+#!/bin/python3
+# ROI counting engine for 2d monitors
+#
+# ROIEngine builds summed-area tables (integral images) of I and I^2 once per
+# monitor, after which the counts in any axis-aligned rectangle, and the
+# error sqrt(sum(I^2)) reported by count.py, take four lookups. Physical ROI
+# limits are converted to pixel ranges with the same pixel coordinates as
+# count.py and find_ROI.py, so results match their mask-based sums.
+
+import numpy as np
+from functools import lru_cache
+
+# number of ROI masks kept by roi_pixels
+MASK_CACHE_SIZE = 64
+
+# Pixel coordinates used by count.py: pixel i sits at extent[0] + i*dx with
+# dx = (xmax - xmin)/(nx - 1), and likewise for y
+def pixel_coordinates(shape, extent):
+	ny, nx = shape
+	dx = (extent[1] - extent[0]) / (nx - 1)
+	dy = (extent[3] - extent[2]) / (ny - 1)
+	return extent[0] + np.arange(nx) * dx, extent[2] + np.arange(ny) * dy
+
+# Zero-padded 2d cumulative sum: S[j, i] = sum of a[:j, :i]
+def summed_area_table(a):
+	S = np.zeros((a.shape[0]+1, a.shape[1]+1))
+	np.cumsum(a, axis=0, out=S[1:, 1:])
+	np.cumsum(S[1:, 1:], axis=1, out=S[1:, 1:])
+	return S
+
+class ROIEngine:
+	def __init__(self, I, extent):
+		self.shape = I.shape
+		self.extent = np.asarray(extent, dtype=float)
+		self.x, self.y = pixel_coordinates(self.shape, self.extent)
+		self.S = summed_area_table(I)
+		self.S2 = summed_area_table(np.square(I))
+
+	@classmethod
+	def from_monitor(cls, mon):
+		return cls(mon.I, mon.extent)
+
+	# Sum of a table over pixel rows [r0, r1) and columns [c0, c1) (arrays broadcast)
+	def box(self, S, r0, r1, c0, c1):
+		return S[r1, c1] - S[r0, c1] - S[r1, c0] + S[r0, c0]
+
+	# Pixel index ranges [c0, c1), [r0, r1) of a rectangle in physical
+	# coordinates, with count.py's convention: x0 <= x < x1 and -y1 <= y < -y0
+	def pixel_box(self, x0, x1, y0, y1):
+		c0 = np.searchsorted(self.x, x0, 'left')
+		c1 = np.maximum(np.searchsorted(self.x, x1, 'left'), c0)
+		r0 = np.searchsorted(self.y, np.negative(y1), 'left')
+		r1 = np.maximum(np.searchsorted(self.y, np.negative(y0), 'left'), r0)
+		return r0, r1, c0, c1
+
+	# Counts and error within rectangles (x0, x1, y0, y1); scalars or arrays
+	def rect_sum(self, x0, x1, y0, y1):
+		r0, r1, c0, c1 = self.pixel_box(x0, x1, y0, y1)
+		counts = self.box(self.S, r0, r1, c0, c1)
+		counts_err = np.sqrt(np.maximum(self.box(self.S2, r0, r1, c0, c1), 0))
+		return counts, counts_err
+
+	# Counts in rectangles of the given widths and heights centred on (xc, yc):
+	# returns (counts, errors) arrays of shape (len(heights), len(widths))
+	def rect_scan(self, xc, yc, widths, heights):
+		w = np.asarray(widths, dtype=float)[np.newaxis, :]
+		h = np.asarray(heights, dtype=float)[:, np.newaxis]
+		return self.rect_sum(xc-w/2, xc+w/2, yc-h/2, yc+h/2)
+
+# Smallest-area rectangle centred on (xc, yc) from a width x height scan whose
+# counts reach threshold times the counts of the largest rectangle scanned.
+# Returns (width, height, counts, counts_err)
+def find_rect_threshold(engine, xc, yc, widths, heights, threshold):
+	widths = np.asarray(widths, dtype=float)
+	heights = np.asarray(heights, dtype=float)
+	counts, counts_err = engine.rect_scan(xc, yc, widths, heights)
+	total = engine.rect_sum(xc-widths.max()/2, xc+widths.max()/2, yc-heights.max()/2, yc+heights.max()/2)[0]
+
+	area = heights[:, np.newaxis] * widths[np.newaxis, :]
+	area = np.where(counts >= threshold * total, area, np.inf)
+	j, i = np.unravel_index(np.argmin(area), area.shape)
+	return widths[i], heights[j], counts[j, i], counts_err[j, i]
+
+# Cumulative counts within circles of any radius around (xc, yc). The pixel
+# distances are computed and sorted once, after which the counts and error
+# within every radius of a sweep follow from one searchsorted. Pixels at
+# exactly the radius are inside, as in count.py's circle ROI (which, unlike
+# the rectangle, uses +y)
+class RadialProfile:
+	def __init__(self, I, extent, xc=0, yc=0):
+		x, y = pixel_coordinates(I.shape, extent)
+		r2 = (x[np.newaxis, :] - xc) ** 2 + (y[:, np.newaxis] - yc) ** 2
+		order = np.argsort(r2, axis=None, kind='stable')
+		values = I.ravel()[order]
+		self.center = (xc, yc)
+		self.r = np.sqrt(r2.ravel()[order])
+		# zero-padded so that index k holds the sum of the k nearest pixels
+		self.S = np.concatenate([[0.], np.cumsum(values)])
+		self.S2 = np.concatenate([[0.], np.cumsum(np.square(values))])
+
+	@classmethod
+	def from_monitor(cls, mon, xc=0, yc=0):
+		return cls(mon.I, mon.extent, xc, yc)
+
+	# Counts and error within the given radii (scalar or array)
+	def counts(self, radii):
+		k = np.searchsorted(self.r, radii, 'right')
+		return self.S[k], np.sqrt(np.maximum(self.S2[k], 0))
+
+	# Radius at which the counts first reach threshold times the counts
+	# within rmax (all pixels if None), interpolated linearly between the
+	# distances of the neighbouring pixels
+	def threshold_radius(self, threshold, rmax=None):
+		n = len(self.r) if rmax is None else np.searchsorted(self.r, rmax, 'right')
+		target = threshold * self.S[n]
+		if n == 0 or target <= 0:
+			return 0.
+
+		# first pixel (in order of distance) with which the target is reached
+		k = min(np.argmax(self.S[1:n+1] >= target), n-1)
+		if k == 0:
+			return self.r[0]
+		c0, c1 = self.S[k], self.S[k+1]
+		r0, r1 = self.r[k-1], self.r[k]
+		if c1 == c0:
+			return r1
+		return r0 + (r1 - r0) * (target - c0) / (c1 - c0)
+
+	# Counts and error within r_in < distance <= r_out
+	def annulus_counts(self, r_in, r_out):
+		k0 = np.searchsorted(self.r, r_in, 'right')
+		k1 = np.searchsorted(self.r, r_out, 'right')
+		return self.S[k1] - self.S[k0], np.sqrt(np.maximum(self.S2[k1] - self.S2[k0], 0))
+
+# Pixels of a square (x0, x1, y0, y1), circle (x0, y0, radius) or annulus
+# (x0, y0, r_in, r_out) ROI, with count.py's conventions, on an image of
+# the given shape and extent. roi is a (kind, limits) tuple. The result is
+# kept in a bounded LRU cache keyed by geometry, so a sequence of monitors
+# sharing shape and extent builds each mask once. Sparse ROIs are returned
+# as a flat index vector, ROIs covering much of the image as a flat boolean
+# mask (both read-only, for indexing I.ravel())
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def roi_pixels(shape, extent, roi):
+	kind, limits = roi
+	x, y = pixel_coordinates(shape, extent)
+	if kind == 'square':
+		x0, x1, y0, y1 = limits
+		mask = ((-y1 <= y) & (y < -y0))[:, np.newaxis] & ((x0 <= x) & (x < x1))[np.newaxis, :]
+	elif kind in ('circle', 'annulus'):
+		r2 = (x[np.newaxis, :] - limits[0]) ** 2 + (y[:, np.newaxis] - limits[1]) ** 2
+		mask = r2 <= limits[-1] ** 2
+		if kind == 'annulus':
+			mask &= r2 > limits[2] ** 2
+	else:
+		raise ValueError("Unknown ROI type: "+kind)
+
+	mask = mask.ravel()
+	# an index costs 8 bytes against 1 byte per pixel for the mask
+	pixels = np.flatnonzero(mask) if np.count_nonzero(mask) * 8 < mask.size else mask
+	pixels.flags.writeable = False
+	return pixels
+
+# Counts and error sqrt(sum(I^2)) within roi (see roi_pixels) using the mask cache
+def masked_sum(I, extent, roi):
+	kind, limits = roi
+	key = (kind, tuple(float(v) for v in limits))
+	values = np.ravel(I)[roi_pixels(tuple(I.shape), tuple(float(v) for v in extent), key)]
+	return np.sum(values), np.sqrt(np.sum(np.square(values)))
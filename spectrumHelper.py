@@ -0,0 +1,86 @@
+#!/bin/python3
+# Vectorized statistics of 1d (wavelength) spectra
+#
+# Spectra are stacked into 2d (spectrum, bin) arrays and every statistic is
+# computed for the whole batch at once: peak position and intensity, FWHM
+# from half-maximum crossings interpolated linearly between bins, the sum
+# within the FWHM (errors added in quadrature) and the intensity per
+# angstrom. Spectra with different binning are grouped by length.
+#
+#	stats = spectrum_stats_batch(glob.glob('runs/*/Sample_Position_spectrum.dat'))
+#	stats['fwhm'], stats['sum'], stats['sum_err']
+
+import numpy as np
+import mcstasHelper as mc
+
+# Half-maximum crossings of each row of I (n, m) around the peak, linearly
+# interpolated in L. A side without a crossing gives the edge of the range
+def half_max_crossings(L, I, peak):
+	n, m = I.shape
+	rows = np.arange(n)
+	hm = I[rows, peak] / 2
+	below = I < hm[:, np.newaxis]
+	idx = np.arange(m)[np.newaxis, :]
+
+	# last bin below half maximum before the peak, first one after it
+	left = below & (idx < peak[:, np.newaxis])
+	has_left = left.any(axis=1)
+	j0 = np.where(has_left, m - 1 - np.argmax(left[:, ::-1], axis=1), 0)
+	right = below & (idx > peak[:, np.newaxis])
+	has_right = right.any(axis=1)
+	j1 = np.where(has_right, np.argmax(right, axis=1), m - 1)
+
+	def interpolate(a, b):
+		Ia, Ib = I[rows, a], I[rows, b]
+		La, Lb = L[rows, a], L[rows, b]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			t = np.where(Ib != Ia, (hm - Ia) / (Ib - Ia), 0)
+		return La + t * (Lb - La)
+
+	x_left = np.where(has_left, interpolate(j0, np.minimum(j0 + 1, m - 1)), L[:, 0])
+	x_right = np.where(has_right, interpolate(np.maximum(j1 - 1, 0), j1), L[:, -1])
+	return x_left, x_right
+
+# Statistics of stacked spectra L, I, sigI of shape (n, m). Returns a dict
+# of length-n arrays: fwhm, left, right (half-maximum wavelengths),
+# wavelength and intensity of the peak, sum and sum_err of the bins whose
+# wavelength lies within the FWHM, and integrated_per_angstrom = sum(I/L)
+def stack_stats(L, I, sigI):
+	L, I, sigI = np.atleast_2d(L, I, sigI)
+	rows = np.arange(I.shape[0])
+	peak = np.argmax(I, axis=1)
+	x_left, x_right = half_max_crossings(L, I, peak)
+
+	window = (L >= x_left[:, np.newaxis]) & (L <= x_right[:, np.newaxis])
+	return {'fwhm': x_right - x_left,
+			'left': x_left,
+			'right': x_right,
+			'wavelength': L[rows, peak],
+			'intensity': I[rows, peak],
+			'sum': np.sum(I, axis=1, where=window),
+			'sum_err': np.sqrt(np.sum(np.square(sigI), axis=1, where=window)),
+			'integrated_per_angstrom': np.sum(I / L, axis=1)}
+
+# Statistics of many 1d monitors (McStasMonitors or filenames) in one call,
+# same keys as stack_stats plus 'filename', in input order
+def spectrum_stats_batch(monitors):
+	monitors = [mc.loadMcStasMonitor(mon) if isinstance(mon, str) else mon for mon in monitors]
+	for mon in monitors:
+		if mon.ndim != 1:
+			raise ValueError("Not 1d data: "+str(mon.filename))
+
+	# spectra with the same number of bins are stacked and processed together
+	groups = {}
+	for i, mon in enumerate(monitors):
+		groups.setdefault(mon.shape[0], []).append(i)
+
+	stats = {}
+	for members in groups.values():
+		data = np.stack([monitors[i].data for i in members])
+		group_stats = stack_stats(data[:, :, 0], data[:, :, 1], data[:, :, 2])
+		for key, values in group_stats.items():
+			if key not in stats:
+				stats[key] = np.empty(len(monitors), dtype=values.dtype)
+			stats[key][members] = values
+	stats['filename'] = [mon.filename for mon in monitors]
+	return stats